@@ -1,12 +1,17 @@
 from langchain.agents import create_agent
 from langchain.chat_models import init_chat_model
 from langchain_mcp_adapters.client import MultiServerMCPClient
-import json
+import asyncio
+import os
+import traceback
+from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import Optional, Any
+from utils import json_utils
 from utils.utils import (
-    get_mcp_servers, cprint, Colors,
+    get_mcp_servers, get_toml_path, get_sub_agents_config, cprint, Colors,
 )
-from utils.utils import get_workspace_path
+from utils.utils import get_workspace_root
 from tools.utils import ErrorHandlingMiddleware
 from langchain.agents.middleware import (
     TodoListMiddleware,
@@ -17,9 +22,129 @@ from deepagents.middleware import (
 from deepagents.backends import (
     FilesystemBackend,
 )
-from pathlib import Path
 from langchain_google_genai.chat_models import ChatGoogleGenerativeAI
 
+# Gemini 官方端点；自定义 base_url（代理/中转）时改用 REST 传输
+_GEMINI_OFFICIAL_BASE_URL = "https://generativelanguage.googleapis.com"
+
+@lru_cache(maxsize=32)
+def init_model(
+    model_name: str,
+    base_url: str,
+    api_key: str,
+    timeout: int = 600,
+    max_retries: int = 3,
+) -> Any:
+    """
+    初始化聊天模型，相同参数返回同一实例
+    共享后端的主代理/子代理复用同一个模型客户端及其连接池
+    Args:
+        model_name: 模型名称
+        base_url: 模型服务地址
+        api_key: API Key
+        timeout: 请求超时（秒）
+        max_retries: 最大重试次数
+    Returns:
+        model: 聊天模型实例
+    """
+    if model_name.startswith("gemini"):
+        return ChatGoogleGenerativeAI(
+            model=model_name,
+            base_url=base_url,
+            api_key=api_key,
+            transport="rest" if base_url != _GEMINI_OFFICIAL_BASE_URL else None,
+            timeout=timeout,
+        )
+    return init_chat_model(
+        model=model_name,
+        base_url=base_url,
+        api_key=api_key,
+        timeout=timeout,
+        max_retries=max_retries,
+    )
+
+# mcpServers 解析缓存: (toml_path, mtime, config)
+_MCP_CACHE: tuple[str, float, dict] | None = None
+
+def _load_mcp_config() -> dict:
+    """
+    读取并解析 mcpServers 配置，按配置文件 mtime 缓存
+    Returns:
+        config: 解析后的 mcpServers 配置字典
+    """
+    global _MCP_CACHE
+    toml_path = get_toml_path()
+    mtime = os.stat(toml_path).st_mtime
+    if _MCP_CACHE is not None and _MCP_CACHE[0] == toml_path and _MCP_CACHE[1] == mtime:
+        return _MCP_CACHE[2]
+
+    config = json_utils.loads(get_mcp_servers())
+    _MCP_CACHE = (toml_path, mtime, config)
+    return config
+
+@dataclass(slots=True)
+class SubAgentSpec:
+    """子代理构建参数（由 TOML 中的 sub agent 配置转换而来）"""
+    name: str
+    model_name: str
+    base_url: str
+    api_key: str
+    system_prompt: str = ""
+    description: str = ""
+    mcp_tools: list[str] = field(default_factory=list)
+    inside_tools: list[Any] = field(default_factory=list)
+    timeout: int = 600          # 默认 10 分钟超时
+    max_retries: int = 3        # 默认重试 3 次
+
+
+# sub agent 构建参数缓存: (toml_path, mtime, specs)
+_SUB_AGENT_SPECS_CACHE: tuple[str, float, tuple[SubAgentSpec, ...]] | None = None
+
+def get_sub_agent_specs() -> tuple[SubAgentSpec, ...]:
+    """
+    获取所有 sub agent 的构建参数，按配置文件 mtime 缓存
+    配置缺少必填字段的 sub agent 会被跳过并打印错误
+    Returns:
+        specs: SubAgentSpec 元组，顺序与配置文件一致
+    """
+    global _SUB_AGENT_SPECS_CACHE
+    toml_path = get_toml_path()
+    try:
+        mtime = os.stat(toml_path).st_mtime
+    except OSError:
+        mtime = -1.0
+    if (
+        _SUB_AGENT_SPECS_CACHE is not None
+        and _SUB_AGENT_SPECS_CACHE[0] == toml_path
+        and _SUB_AGENT_SPECS_CACHE[1] == mtime
+    ):
+        return _SUB_AGENT_SPECS_CACHE[2]
+
+    specs = []
+    for name, cfg in get_sub_agents_config().items():
+        try:
+            specs.append(SubAgentSpec(
+                name=name,
+                model_name=cfg["model_name"],
+                base_url=cfg["base_url"],
+                api_key=cfg["api_key"],
+                system_prompt=cfg.get("system_prompt", ""),
+                description=cfg.get("description", ""),
+                mcp_tools=cfg.get("mcp_tools", []),
+                inside_tools=cfg.get("inside_tools", []),
+                # 支持从子代理配置中读取超时设置，默认 10 分钟
+                timeout=cfg.get("timeout", 600),
+                max_retries=cfg.get("max_retries", 3),
+            ))
+        except Exception as e:
+            cprint(
+                f"[build_agent] Sub agent '{name}' config error: {e}", 
+                Colors.FAIL
+            )
+
+    _SUB_AGENT_SPECS_CACHE = (toml_path, mtime, tuple(specs))
+    return _SUB_AGENT_SPECS_CACHE[2]
+
 async def build_sub_agent(
     model_name: str,
     base_url: str,
@@ -34,51 +159,68 @@ async def build_sub_agent(
 
     mcp_tools_list = []
 
+    config: dict = {}
+    if mcp_tools:
+        try:
+            config = _load_mcp_config()
+        except Exception as e:
+            cprint(
+                f"[build_sub_agent] Warning: failed to load mcpServers config: {e}. Continuing...", 
+                Colors.WARNING
+            )
+            mcp_tools = []
+
+    async def _fetch_one(tool_name: str) -> list[Any]:
+        """拉取单个 MCP server 的工具"""
+        mcp_client = MultiServerMCPClient({
+            tool_name: config["mcpServers"][tool_name]
+        })
+        return await mcp_client.get_tools()
+
+    wanted_tools = []
     for tool_name in mcp_tools if mcp_tools else []:
+        if tool_name not in config.get("mcpServers", {}):
+            cprint(
+                f"[build_sub_agent] Warning: tool '{tool_name}' not found in mcpServers", 
+                Colors.WARNING
+            )
+            continue
+        wanted_tools.append(tool_name)
+
+    if wanted_tools:
         try:
-            config = json.loads(get_mcp_servers())
-            
-            if tool_name not in config.get("mcpServers", {}):
-                cprint(
-                    f"[build_sub_agent] Warning: tool '{tool_name}' not found in mcpServers", 
-                    Colors.WARNING
-                )
-                continue
-            
+            # 单个 client 一次性拉取所有 server 的工具
             mcp_client = MultiServerMCPClient({
-                tool_name: config["mcpServers"][tool_name]
+                tool_name: config["mcpServers"][tool_name] for tool_name in wanted_tools
             })
-            
             fetched_tools = await mcp_client.get_tools()
             if fetched_tools:
                 mcp_tools_list.extend(fetched_tools)
-
         except Exception as e:
             cprint(
-                f"[build_sub_agent] Warning: failed to load MCP tool '{tool_name}': {e}. Continuing...", 
+                f"[build_sub_agent] Warning: batch MCP tool loading failed: {e}. Retrying per server...", 
                 Colors.WARNING
             )
+            # 回退：逐个 server 并发拉取，隔离失败的 server
+            results = await asyncio.gather(
+                *(_fetch_one(tool_name) for tool_name in wanted_tools),
+                return_exceptions=True
+            )
+            for tool_name, fetched_tools in zip(wanted_tools, results):
+                if isinstance(fetched_tools, BaseException):
+                    cprint(
+                        f"[build_sub_agent] Warning: failed to load MCP tool '{tool_name}': {fetched_tools}. Continuing...", 
+                        Colors.WARNING
+                    )
+                    continue
+                if fetched_tools:
+                    mcp_tools_list.extend(fetched_tools)
+
     if inside_tools:
         mcp_tools_list.extend(inside_tools)
     try:
         # 子代理可能执行较长时间的任务，使用传入的超时配置
-        model = None
-        if model_name.startswith("gemini"):
-            model = ChatGoogleGenerativeAI(
-                model=model_name,
-                base_url=base_url,
-                api_key=api_key,
-                transport= "rest" if base_url!="https://generativelanguage.googleapis.com" else None,
-                timeout=timeout,
-            )
-        else:
-            model = init_chat_model(
-                model=model_name,
-                base_url=base_url,
-                api_key=api_key,
-                timeout=timeout,
-                max_retries=max_retries,
-            )
+        model = init_model(model_name, base_url, api_key, timeout, max_retries)
         agent = create_agent(
             model=model,
             tools=mcp_tools_list if mcp_tools_list else None,
@@ -87,7 +229,7 @@ async def build_sub_agent(
                 TodoListMiddleware(),
                 FilesystemMiddleware(
                     backend=FilesystemBackend(
-                        root_dir=Path(get_workspace_path()).resolve(), 
+                        root_dir=get_workspace_root(), 
                         virtual_mode=True
                     )
                 ),
@@ -99,6 +241,5 @@ async def build_sub_agent(
     
     except Exception as e:
         cprint(f"[build_sub_agent] Error creating agent: {e}", Colors.FAIL)
-        import traceback
         cprint(traceback.format_exc(), Colors.FAIL)
         return None
\ No newline at end of file
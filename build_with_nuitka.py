@@ -32,17 +32,35 @@ def get_os_specific_flags():
         # Windows 使用 MinGW-w64 编译器
         flags.append("--mingw64")
     elif system == "Linux":
-        # Linux 特定参数
-        pass
+        # Linux 特定参数：有 clang 时优先使用（生成代码优化更好）
+        if shutil.which("clang"):
+            flags.append("--clang")
     elif system == "Darwin":
         # MacOS 特定参数
         flags.append("--macos-create-app-bundle")
+        flags.append("--clang")
     
     return flags
 
 def prepare_compiler_environment():
-    """Return a copy of the current environment for the subprocess call."""
-    return os.environ.copy()
+    """Return a copy of the current environment for the subprocess call.
+
+    Nuitka picks up ccache automatically when it is on PATH; point it at a
+    persistent, size-capped cache so rebuilds reuse compiled C objects.
+    Values already set by the caller (e.g. the CI ccache action) are kept.
+    """
+    env = os.environ.copy()
+
+    ccache_path = shutil.which("ccache")
+    if ccache_path:
+        env.setdefault("NUITKA_CCACHE_BINARY", ccache_path)
+        env.setdefault("CCACHE_DIR", os.path.expanduser("~/.cache/ccache-captain"))
+        env.setdefault("CCACHE_MAXSIZE", "5G")
+        print(f"[*] Using ccache at: {ccache_path} (dir: {env['CCACHE_DIR']})")
+    else:
+        print("[*] ccache not found in PATH, C files will be compiled from scratch")
+
+    return env
 
 
 def ensure_windows_mingw():
@@ -87,14 +105,7 @@ def build():
 
         # 强制包含 LangChain 核心库及其所有子模块（使用延迟加载，必须显式包含）
         "--include-package=langchain",
-        "--include-package=langchain_core",
-        "--include-package=langchain_core.load",
-        "--include-module=langchain_core.load.dump",
-        "--include-module=langchain_core.load.load",
-        "--include-module=langchain_core.load.serializable",
-        "--include-package=langchain_core.runnables",
-        "--include-package=langchain_core.tracers",
-        "--include-package=langchain_core.callbacks",
+        "--include-package=langchain_core",   # 已包含 load/runnables/tracers/callbacks 等全部子模块
         "--include-package=langgraph",
         "--include-package=deepagents",
         "--include-package=langchain_community",
@@ -109,7 +120,6 @@ def build():
         "--include-package=langchain_mistralai",
         "--include-package=langchain_huggingface",
         "--include-package=langchain_xai",
-        "--include-package=langchain_huggingface",
         "--include-package=langchain_qwq",
         "--include-package=chromadb",
         "--include-package=langchain_chroma",
@@ -133,6 +143,9 @@ def build():
         # "--include-data-dir=./data=data",
 
         # 优化选项
+        "--lto=yes",                      # 链接时优化
+        "--python-flag=no_asserts",       # 去除 assert 语句
+        "--python-flag=isolated",         # 忽略 PYTHON* 环境变量与用户 site-packages
         "--noinclude-pytest-mode=nofollow",
         "--noinclude-setuptools-mode=nofollow",
         
@@ -140,6 +153,10 @@ def build():
         "--nofollow-import-to=aiosqlite.tests",
         "--nofollow-import-to=unittest",
         "--nofollow-import-to=doctest",
+        "--nofollow-import-to=tests",
+        "--nofollow-import-to=*.tests",
+        "--nofollow-import-to=numpy.testing",
+        "--nofollow-import-to=IPython",
     ]
     
     print("[*] Using Nuitka's automatic import tracking (--follow-imports)")
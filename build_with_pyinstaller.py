@@ -41,7 +41,6 @@ COLLECT_ALL_PACKAGES = [
     "langchain_mistralai",
     "langchain_huggingface",
     "langchain_xai",
-    "langchain_huggingface",
     "langchain_qwq",
     "langchain_google_vertexai",
     "chromadb",
@@ -1,54 +1,137 @@
-from langchain.agents import create_agent
-from langchain.chat_models import init_chat_model
-from agent.agent import build_sub_agent
-from tools.shell_exec import shell_exec
-from tools.web_search import internet_search
+import asyncio
+import hashlib
 import json
-from typing import Optional, Any, AsyncGenerator, cast
-from langchain_core.messages import HumanMessage
+import os
+import traceback
+from dataclasses import asdict, dataclass, field
+from typing import Optional, Any, AsyncGenerator, Callable, Iterator, cast, TYPE_CHECKING
+from langchain_core.messages import HumanMessage, ToolMessage
 from pathlib import Path
 from utils.utils import (
     cprint, Colors,
     get_database_path, get_local_file_store_path,
     get_major_config, get_sub_agents_config,
-    get_workspace_path
-)
-from tools.utils import ErrorHandlingMiddleware
-from tools.vlm_tools import read_image
-from langchain.agents.middleware import (
-    TodoListMiddleware,
+    get_major_agent_config, get_workspace_root,
+    get_mcp_servers, get_config_stamp,
 )
+from utils import json_utils
 
-from deepagents.middleware import (
-    FilesystemMiddleware,
-    SubAgentMiddleware,
-    CompiledSubAgent
-)
+# LangChain / deepagents / langgraph-sqlite 等重量级依赖在首次构建 agent 或
+# 初始化数据库时才导入，避免拖慢 CLI 冷启动
+if TYPE_CHECKING:
+    import aiosqlite
+
+_store = None
+_checkpoint = None
+# process_agent 产出的、无需转换即可直接交给调用方的事件类型
+_PASSTHROUGH_EVENTS = frozenset({
+    "model_answer", "model_thinking",
+    "sub_agent_start", "sub_agent_end",
+    "sub_agent_answer", "sub_agent_thinking",
+    "tool_call", "tool_result",
+    "sub_agent_tool_call", "sub_agent_tool_result",
+    "error",
+})
+
+# CAPTAIN_DEBUG=1 时流式循环内的单条事件错误也附带完整堆栈
+_DEBUG = os.environ.get("CAPTAIN_DEBUG") == "1"
+
+# read_image 工具返回值中的图片标记（序列化后位于 JSON 开头）
+_VLM_IMAGE_MARKER = '"__vlm_image__"'
+
+class LazyTraceback:
+    """
+    延迟格式化的异常堆栈
+    仅在 str() 时才遍历栈帧生成文本，未被消费的错误事件不产生格式化开销
+    """
+    __slots__ = ("exc",)
+
+    def __init__(self, exc: BaseException):
+        self.exc = exc
 
-from deepagents.backends import (
-    FilesystemBackend
+    def __str__(self) -> str:
+        return "".join(traceback.format_exception(type(self.exc), self.exc, self.exc.__traceback__))
+
+# 当前 major agent: (构建参数, agent)，构建参数含配置文件版本标识
+# 只保留一个，参数或配置变化后旧 agent（及其 sub agent、模型客户端）随之释放
+_major_agent: Optional[tuple[tuple, Any]] = None
+
+# 已构建的 sub agent runnable: 构建参数指纹 -> runnable
+# major agent 因配置变化重建时，配置未变的 sub agent 无需重新加载 MCP 工具
+_SUB_AGENTS: dict[str, Any] = {}
+
+def _sub_agent_fingerprint(spec: Any) -> str:
+    """计算 sub agent 构建参数（含 mcpServers 配置）的指纹"""
+    return hashlib.blake2b(
+        json.dumps(
+            [asdict(spec), get_mcp_servers()],
+            sort_keys=True, ensure_ascii=False, default=str
+        ).encode()
+    ).hexdigest()
+
+# 连接级 SQLite 性能参数
+# WAL + synchronous=NORMAL：每次 checkpoint 提交不再强制 fsync，崩溃时最多丢失最近的事务
+_SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",   # 256 MB
+    "PRAGMA cache_size=-65536",     # 64 MB
+    "PRAGMA busy_timeout=5000",     # 写锁被占用时等待 5 秒而不是立即 SQLITE_BUSY
+    "PRAGMA wal_autocheckpoint=1000",
 )
 
-from langchain_google_genai.chat_models import ChatGoogleGenerativeAI
+async def _apply_sqlite_pragmas(conn: "aiosqlite.Connection"):
+    """为 aiosqlite 连接设置性能相关 PRAGMA"""
+    for pragma in _SQLITE_PRAGMAS:
+        await conn.execute(pragma)
+    await conn.commit()
 
-from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
-from langgraph.store.sqlite.aio import AsyncSqliteStore
-import aiosqlite
+# aiosqlite 连接池: 数据库路径 -> 连接（每个连接占用一个后台线程）
+_CONN_POOL: dict[str, "aiosqlite.Connection"] = {}
 
-from tools.mod_vector import store_markdown, search_vectors, list_collections
-from tools.fetch_url import fetch_url
-_store = None
-_checkpoint = None
-_major_agent = None
+async def _get_conn(path: str) -> "aiosqlite.Connection":
+    """
+    获取指定数据库文件的共享连接，不存在时创建
+    store 与 checkpoint 指向同一文件时复用同一连接
+    """
+    import aiosqlite
+
+    key = str(Path(path).resolve())
+    conn = _CONN_POOL.get(key)
+    if conn is None:
+        conn = await aiosqlite.connect(key)
+        await _apply_sqlite_pragmas(conn)
+        _CONN_POOL[key] = conn
+    return conn
+
+# 关闭阶段的等待上限（秒），避免卡住的后台任务/连接阻塞退出
+_STORE_TASK_STOP_TIMEOUT = 2.0
+_CONN_CLOSE_TIMEOUT = 5.0
+
+async def _close_conn_pool():
+    """关闭连接池中的所有连接"""
+    conns = list(_CONN_POOL.values())
+    _CONN_POOL.clear()
+    for conn in conns:
+        try:
+            await asyncio.wait_for(conn.close(), timeout=_CONN_CLOSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            cprint("[cleanup] Timed out closing connection", Colors.WARNING)
+        except Exception as e:
+            cprint(f"[cleanup] Error closing connection: {e}", Colors.WARNING)
 
 async def init_resources():
     """初始化数据库连接"""
     global _store, _checkpoint
     
     try:
-        # 创建异步连接
-        store_conn = await aiosqlite.connect(get_local_file_store_path())
-        checkpoint_conn = await aiosqlite.connect(get_database_path())
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+        from langgraph.store.sqlite.aio import AsyncSqliteStore
+        
+        # 获取（共享的）异步连接
+        store_conn = await _get_conn(get_local_file_store_path())
+        checkpoint_conn = await _get_conn(get_database_path())
         
         # 创建存储对象
         _store = AsyncSqliteStore(conn=store_conn)
@@ -62,6 +145,23 @@ async def init_resources():
         cprint(f"[init_resources] Failed to initialize resources: {e}", Colors.FAIL)
         return False
 
+# 保证并发的首次调用只初始化一次数据库 / 只构建一次 agent
+_resources_lock = asyncio.Lock()
+_major_agent_lock = asyncio.Lock()
+
+async def ensure_resources() -> bool:
+    """
+    确保数据库资源已初始化（并发安全，只初始化一次）
+    Returns:
+        是否初始化成功
+    """
+    if _store is not None and _checkpoint is not None:
+        return True
+    async with _resources_lock:
+        if _store is not None and _checkpoint is not None:
+            return True
+        return await init_resources()
+
 async def build_agent(
     model_name: str,
     base_url: str,
@@ -70,85 +170,90 @@ async def build_agent(
 ) -> Optional[Any]:
     """构建 deep agent"""
     
-    global _store, _checkpoint, _major_agent, _llm_tool_selector_model, _summarization_model
+    global _store, _checkpoint
+    
+    from langchain.agents import create_agent
+    from langchain.agents.middleware import TodoListMiddleware
+    from deepagents.middleware import (
+        FilesystemMiddleware,
+        SubAgentMiddleware,
+        CompiledSubAgent
+    )
+    from deepagents.backends import FilesystemBackend
+    
+    from agent.agent import build_sub_agent, get_sub_agent_specs, init_model, SubAgentSpec
+    from tools.utils import ErrorHandlingMiddleware
+    from tools.shell_exec import shell_exec
+    from tools.web_search import internet_search
+    from tools.vlm_tools import read_image
+    from tools.mod_vector import search_vectors, list_collections
+    from tools.fetch_url import fetch_url
     
-    # 获取 sub agents 配置 (新的 TOML 格式)
-    sub_agents_config = get_sub_agents_config()
-       
+    async def _build_one(spec: SubAgentSpec, key: str) -> Optional[Any]:
+        """构建单个子代理，构建参数未变时复用已有 runnable"""
+        agent = _SUB_AGENTS.get(key)
+        if agent is not None:
+            return agent
+        agent = await build_sub_agent(
+            model_name=spec.model_name,
+            base_url=spec.base_url,
+            api_key=spec.api_key,
+            system_prompt=spec.system_prompt,
+            mcp_tools=spec.mcp_tools,
+            inside_tools=spec.inside_tools,
+            timeout=spec.timeout,
+            max_retries=spec.max_retries,
+        )
+        if agent is None:
+            cprint(
+                f"[build_agent] Sub agent '{spec.name}' build failed", 
+                Colors.FAIL
+            )
+        else:
+            _SUB_AGENTS[key] = agent
+        return agent
+
+    # 各子代理独立加载 MCP 工具，并发构建
+    sub_agent_specs = get_sub_agent_specs()
+    sub_agent_keys = [_sub_agent_fingerprint(spec) for spec in sub_agent_specs]
+    built_agents = await asyncio.gather(
+        *(_build_one(spec, key) for spec, key in zip(sub_agent_specs, sub_agent_keys)),
+        return_exceptions=True
+    )
+    # 只保留当前配置用到的子代理，配置已变的旧子代理随之释放
+    for stale_key in _SUB_AGENTS.keys() - set(sub_agent_keys):
+        del _SUB_AGENTS[stale_key]
+
     sub_agent = []
-    for sub_agent_name, sub_agent_config in sub_agents_config.items():
-        try:
-            sub_model_name = sub_agent_config["model_name"]
-            sub_base_url = sub_agent_config["base_url"]
-            sub_api_key = sub_agent_config["api_key"]
-            sub_system_prompt = sub_agent_config.get("system_prompt", "")
-            mcp_tools = sub_agent_config.get("mcp_tools", [])
-            inside_tools = sub_agent_config.get("inside_tools", [])
-            # 支持从子代理配置中读取超时设置，默认 10 分钟
-            sub_timeout = sub_agent_config.get("timeout", 600)
-            sub_max_retries = sub_agent_config.get("max_retries", 3)
-        except Exception as e:
+    for spec, agent in zip(sub_agent_specs, built_agents):
+        if isinstance(agent, BaseException):
             cprint(
-                f"[build_agent] Sub agent '{sub_agent_name}' config error: {e}", 
+                f"[build_agent] Sub agent '{spec.name}' build failed: {agent}", 
                 Colors.FAIL
             )
             continue
-
-        agent = await build_sub_agent(
-            model_name=sub_model_name,
-            base_url=sub_base_url,
-            api_key=sub_api_key,
-            system_prompt=sub_system_prompt,
-            mcp_tools=mcp_tools,
-            inside_tools=inside_tools,
-            timeout=sub_timeout,
-            max_retries=sub_max_retries,
-        )
         if agent is not None:
             sub_agent.append(
                 CompiledSubAgent(
-                    name=sub_agent_name,
-                    description=sub_agent_config.get("description", ""),
+                    name=spec.name,
+                    description=spec.description,
                     runnable=agent
                 )
             )
-        else:
-            cprint(
-                f"[build_agent] Sub agent '{sub_agent_name}' build failed", 
-                Colors.FAIL
-            )
 
     try:
         # 初始化模型
         # 设置较长的超时时间以支持子代理长时间执行
         # 默认 10 分钟超时，可在配置中覆盖
-        from utils.utils import get_major_agent_config as get_config
-        agent_config = get_config() or {}
+        agent_config = get_major_agent_config() or {}
         timeout = agent_config.get("timeout", 600)  # 默认 10 分钟
         max_retries = agent_config.get("max_retries", 3)  # 默认重试 3 次
         
-        model = None
-        if model_name.startswith("gemini"):
-            model = ChatGoogleGenerativeAI(
-                model=model_name,
-                base_url=base_url,
-                api_key=api_key,
-                transport= "rest" if base_url!="https://generativelanguage.googleapis.com" else None,
-                timeout=timeout,
-            )
-        else:
-            model = init_chat_model(
-                model=model_name,
-                base_url=base_url,
-                api_key=api_key,
-                timeout=timeout,
-                max_retries=max_retries,
-            )
+        model = init_model(model_name, base_url, api_key, timeout, max_retries)
 
         # 确保资源已初始化
-        if _store is None or _checkpoint is None:
-            if not await init_resources():
-                raise RuntimeError("Failed to initialize database resources")
+        if not await ensure_resources():
+            raise RuntimeError("Failed to initialize database resources")
         
         # 创建代理
         agent = create_agent(
@@ -162,7 +267,7 @@ async def build_agent(
                 TodoListMiddleware(),
                 FilesystemMiddleware(
                     backend=FilesystemBackend(
-                        root_dir=Path(get_workspace_path()).resolve(), 
+                        root_dir=get_workspace_root(), 
                         virtual_mode=True
                     )
                 ),
@@ -175,30 +280,194 @@ async def build_agent(
             ]
         )
 
-        _major_agent = agent
         return agent
         
     except Exception as e:
         cprint(f"[build_agent] Error creating agent: {e}", Colors.FAIL)
-        import traceback
         cprint(traceback.format_exc(), Colors.FAIL)
         return None
 
+def _major_agent_block_event(event_type: str, content: str, subagent_name: Optional[str]) -> dict:
+    """构造主代理的流式内容事件"""
+    return {"type": event_type, "content": content}
+
+def _sub_agent_block_event(event_type: str, content: str, subagent_name: Optional[str]) -> dict:
+    """构造子代理的流式内容事件"""
+    return {"type": event_type, "content": content, "subagent": subagent_name}
+
+# namespace_task_ids 未命中标记
+_NO_TASK_ID: Any = object()
+
+def _scan_namespace_task_id(namespace: tuple) -> Optional[str]:
+    """查找 namespace 中的 task:xxx 部分，返回完整的 'task:call_xxx'"""
+    for ns_part in namespace:
+        ns_str = str(ns_part)
+        if ns_str.startswith("task:"):
+            return ns_str
+    return None
+
+# 流式文本增量合并阈值（字符数），减少逐 token 的小事件
+_TEXT_FLUSH_CHARS = 32
+
+@dataclass
+class _AgentRun:
+    """单次 process_agent 调用的运行状态"""
+    agent: Any
+    config: dict
+    # 跟踪活动的子代理：task_id -> subagent_name
+    active_subagents: dict[str, str] = field(default_factory=dict)
+    # 当前活动的子代理名称
+    current_subagent: Optional[str] = None
+    # 后台执行的图片注入任务（不阻塞流式输出）
+    pending_updates: set[asyncio.Task] = field(default_factory=set)
+    # namespace -> 其中的 task ID（None 表示不含 task:xxx）
+    namespace_task_ids: dict[tuple, Optional[str]] = field(default_factory=dict)
+    # 合并中的文本/思考增量: (事件类型, 子代理名称, 构造函数) 与已缓冲的片段
+    text_key: Optional[tuple] = None
+    text_buf: list[str] = field(default_factory=list)
+    text_len: int = 0
+
+    def buffer_text(self, key: tuple, text: str) -> Optional[dict]:
+        """缓冲一段流式增量；类型/来源变化或缓冲达到阈值时返回合并后的事件"""
+        event = self.flush_text() if key != self.text_key else None
+        self.text_key = key
+        self.text_buf.append(text)
+        self.text_len += len(text)
+        if self.text_len >= _TEXT_FLUSH_CHARS:
+            # 类型切换与阈值刷新不会同时发生（切换后缓冲只有一段）
+            return self.flush_text() if event is None else event
+        return event
+
+    def flush_text(self) -> Optional[dict]:
+        """把缓冲的增量合并为一个事件返回，缓冲为空时返回 None"""
+        if not self.text_buf:
+            return None
+        event_type, subagent_name, make_event = self.text_key  # type: ignore[misc]
+        event = make_event(event_type, "".join(self.text_buf), subagent_name)
+        self.text_buf.clear()
+        self.text_len = 0
+        return event
+
+# ---- 主代理工具事件处理器：按工具名分发，未登记的工具走默认处理 ----
+
+def _on_tool_call(run: _AgentRun, tool_name: str, args: dict, call_id: Optional[str]) -> Iterator[dict]:
+    """普通工具调用"""
+    yield {
+        "type": "tool_call",
+        "name": tool_name,
+        "args": args,
+        "id": call_id
+    }
+
+def _on_task_call(run: _AgentRun, tool_name: str, task_args: dict, call_id: Optional[str]) -> Iterator[dict]:
+    """主代理调用 task 工具 -> 启动子代理，产出特殊事件，不当作普通工具处理"""
+    task_call_id = call_id or ''
+    subagent_type = task_args.get('subagent_type', 'general')
+    # 记录 task ID 到子代理名称的映射
+    # namespace 中会出现 'task:call_xxx' 格式
+    run.active_subagents[f"task:{task_call_id}"] = subagent_type
+    # 设置当前活动的子代理名称
+    run.current_subagent = subagent_type
+    yield {
+        "type": "sub_agent_start",
+        "subagent": subagent_type,
+        "task": task_args.get('description', ''),
+        "id": task_call_id
+    }
+
+def _on_tool_result(run: _AgentRun, msg: ToolMessage) -> Iterator[dict]:
+    """普通工具结果"""
+    yield {
+        "type": "tool_result",
+        "content": msg.content,
+        "id": msg.tool_call_id,
+    }
+
+def _on_task_result(run: _AgentRun, msg: ToolMessage) -> Iterator[dict]:
+    """task 工具完成 = 子代理完成，产出子代理完成事件（包含最终结果摘要）"""
+    yield {
+        "type": "sub_agent_end",
+        "content": msg.content,
+        "id": msg.tool_call_id,
+    }
+    # 清除当前活动的子代理名称
+    run.current_subagent = None
+
+def _on_read_image_result(run: _AgentRun, msg: ToolMessage) -> Iterator[dict]:
+    """read_image 工具结果：除普通结果外，将图片内容注入为 HumanMessage"""
+    yield from _on_tool_result(run, msg)
+    
+    try:
+        # 工具返回的是带有 __vlm_image__ 标记的 JSON
+        content = msg.content
+        image_content = None
+        
+        # 解析 JSON 格式的工具返回值
+        # 先检查开头是否带标记，避免对普通结果做无效的 JSON 解析
+        if isinstance(content, str) and _VLM_IMAGE_MARKER in content[:64]:
+            try:
+                parsed = json_utils.loads(content)
+                # 检查是否有 __vlm_image__ 标记
+                if isinstance(parsed, dict) and parsed.get('__vlm_image__'):
+                    image_content = parsed.get('content')
+            except json_utils.JSONDecodeError:
+                pass
+        elif isinstance(content, dict) and content.get('__vlm_image__'):
+            image_content = content.get('content')
+        
+        # 如果成功解析到图片内容，后台注入 HumanMessage
+        if image_content:
+            image_message = HumanMessage(content=image_content)
+            task = asyncio.create_task(run.agent.aupdate_state(
+                config=run.config,
+                values={"messages": [image_message]}
+            ))
+            run.pending_updates.add(task)
+            task.add_done_callback(run.pending_updates.discard)
+    
+    except Exception as e:
+        yield {
+            "type": "error",
+            "content": f"Failed to inject image message: {e}"
+        }
+
+_TOOL_CALL_HANDLERS: dict[str, Callable[[_AgentRun, str, dict, Optional[str]], Iterator[dict]]] = {
+    "task": _on_task_call,
+}
+
+_TOOL_RESULT_HANDLERS: dict[str, Callable[[_AgentRun, ToolMessage], Iterator[dict]]] = {
+    "task": _on_task_result,
+    "read_image": _on_read_image_result,
+}
+
+# checkpoint 写入策略（LangGraph durability）
+# sync: 每步同步写入；async: 后台写入，与下一步执行重叠；exit: 仅在本轮结束时写入一次
+_CHECKPOINT_DURABILITY = ("sync", "async", "exit")
+
+def _get_checkpoint_durability() -> str:
+    """从 major agent 配置读取 checkpoint_durability，默认 async"""
+    durability = (get_major_agent_config() or {}).get("checkpoint_durability", "async")
+    if durability not in _CHECKPOINT_DURABILITY:
+        cprint(
+            f"[process_agent] Warning: invalid checkpoint_durability '{durability}', using 'async'", 
+            Colors.WARNING
+        )
+        return "async"
+    return durability
+
 async def process_agent(agent: Any, message: str):
     """处理代理流式输出"""
-    # 跟踪活动的子代理：task_id -> subagent_name
-    active_subagents: dict[str, str] = {}
-    # 使用字典存储当前活动的子代理名称（避免 nonlocal 问题）
-    state = {"current_subagent": None}
+    config = get_major_config()
+    run = _AgentRun(agent=agent, config=config)
     
     try:
         messages = [HumanMessage(content=message)]
-        config = get_major_config()
         async for raw_data in agent.astream(
             {"messages": messages},
             stream_mode=["updates", "messages"],
             subgraphs=True,  # 启用子图流式输出以获取 sub_agent 的详细信息
-            config=config
+            config=config,
+            durability=_get_checkpoint_durability(),
         ):
             try:
                 # subgraphs=True 时返回格式: (namespace, stream_mode, chunk)
@@ -216,16 +485,16 @@ async def process_agent(agent: Any, message: str):
                 # 用它来查找之前记录的子代理名称
                 subagent_name = None
                 if is_subagent and namespace:
-                    # 查找 namespace 中的 task:xxx 部分
-                    for ns_part in namespace:
-                        ns_str = str(ns_part)
-                        if ns_str.startswith("task:"):
-                            task_id = ns_str  # 完整的 'task:call_xxx'
-                            subagent_name = active_subagents.get(task_id)
-                            break
+                    # 同一 namespace 的 task ID 只扫描一次
+                    task_id = run.namespace_task_ids.get(namespace, _NO_TASK_ID)
+                    if task_id is _NO_TASK_ID:
+                        task_id = _scan_namespace_task_id(namespace)
+                        run.namespace_task_ids[namespace] = task_id
+                    if task_id is not None:
+                        subagent_name = run.active_subagents.get(task_id)
                     # 如果没找到映射，使用当前活动的子代理名称
                     if subagent_name is None:
-                        subagent_name = state["current_subagent"]
+                        subagent_name = run.current_subagent
                 
                 # ============ messages 模式：流式 token ============
                 if stream_mode == "messages":
@@ -237,44 +506,46 @@ async def process_agent(agent: Any, message: str):
                     node_name = metadata.get("langgraph_node", "")
                     
                     # 检查 token 是否有 content_blocks
-                    if not hasattr(token, 'content_blocks') or not token.content_blocks:
+                    # content_blocks 是每次访问都重新计算的属性，只取一次
+                    blocks = getattr(token, 'content_blocks', None)
+                    if not blocks:
                         continue
                     
-                    for block in token.content_blocks:
+                    node_is_model = node_name == "model"
+                    # 主代理 / 子代理的事件类型与构造函数每个 token 只选择一次
+                    if is_subagent:
+                        text_type, reasoning_type = "sub_agent_answer", "sub_agent_thinking"
+                        make_event = _sub_agent_block_event
+                    else:
+                        text_type, reasoning_type = "model_answer", "model_thinking"
+                        make_event = _major_agent_block_event
+                    
+                    for block in blocks:
+                        block_type = block.get("type")
                         # 模型的文本输出
-                        if block.get("type") == "text" and node_name == "model":
-                            if is_subagent:
-                                # 子代理的模型回答
-                                yield {
-                                    "type": "sub_agent_answer",
-                                    "content": block.get('text', ''),
-                                    "subagent": subagent_name,
-                                }
-                            else:
-                                yield {
-                                    "type": "model_answer",
-                                    "content": block.get('text', ''),
-                                }
+                        if block_type == "text" and node_is_model:
+                            key, text = (text_type, subagent_name, make_event), block.get('text', '')
                         # 模型的思考过程
-                        elif block.get("type") == "reasoning":
-                            if is_subagent:
-                                # 子代理的思考过程
-                                yield {
-                                    "type": "sub_agent_thinking",
-                                    "content": block.get('reasoning', ''),
-                                    "subagent": subagent_name,
-                                }
-                            else:
-                                yield {
-                                    "type": "model_thinking",
-                                    "content": block.get('reasoning', ''),
-                                }
+                        elif block_type == "reasoning":
+                            key, text = (reasoning_type, subagent_name, make_event), block.get('reasoning', '')
+                        else:
+                            continue
+                        # 空增量不产生事件，连续的小增量合并后再输出
+                        if text:
+                            event = run.buffer_text(key, text)
+                            if event is not None:
+                                yield event
                 
                 # ============ updates 模式：状态更新 ============
                 elif stream_mode == "updates":
                     if chunk is None:
                         continue
                     
+                    # 工具/子代理事件之前先输出已缓冲的文本，保持事件顺序
+                    event = run.flush_text()
+                    if event is not None:
+                        yield event
+                    
                     # chunk 是 dict: {node_name: {state_updates}}
                     for node_name, node_data in chunk.items():
                         if node_data is None:
@@ -285,49 +556,29 @@ async def process_agent(agent: Any, message: str):
                         
                         for msg in messages_list:
                             # ---- 处理工具调用 ----
-                            if hasattr(msg, 'tool_calls') and msg.tool_calls:
-                                for tc in msg.tool_calls:
-                                    tool_name = tc.get('name') or tc['name']
+                            tool_calls = getattr(msg, 'tool_calls', None)
+                            if tool_calls:
+                                for tc in tool_calls:
+                                    tool_name = tc.get('name')
+                                    args = tc.get('args', {})
+                                    call_id = tc.get('id')
                                     
                                     if is_subagent:
                                         # 子代理的工具调用
                                         yield {
                                             "type": "sub_agent_tool_call",
                                             "name": tool_name,
-                                            "args": tc.get('args', {}),
-                                            "id": tc.get('id'),
+                                            "args": args,
+                                            "id": call_id,
                                             "subagent": subagent_name,
                                         }
-                                    elif tool_name == "task":
-                                        # 主代理调用 task 工具 -> 启动子代理
-                                        # 产出特殊事件，不当作普通工具处理
-                                        task_args = tc.get('args', {})
-                                        task_call_id = tc.get('id', '')
-                                        subagent_type = task_args.get('subagent_type', 'general')
-                                        # 记录 task ID 到子代理名称的映射
-                                        # namespace 中会出现 'task:call_xxx' 格式
-                                        active_subagents[f"task:{task_call_id}"] = subagent_type
-                                        # 设置当前活动的子代理名称
-                                        state["current_subagent"] = subagent_type
-                                        yield {
-                                            "type": "sub_agent_start",
-                                            "subagent": subagent_type,
-                                            "task": task_args.get('description', ''),
-                                            "id": task_call_id
-                                        }
                                     else:
-                                        # 普通工具调用
-                                        yield {
-                                            "type": "tool_call",
-                                            "name": tool_name,
-                                            "args": tc.get('args', {}),
-                                            "id": tc.get('id')
-                                        }
+                                        handler = _TOOL_CALL_HANDLERS.get(tool_name or '', _on_tool_call)
+                                        for event in handler(run, tool_name, args, call_id):
+                                            yield event
                             
                             # ---- 处理工具结果 ----
-                            if msg.__class__.__name__ == "ToolMessage":
-                                tool_name = getattr(msg, 'name', '')
-                                
+                            if isinstance(msg, ToolMessage):
                                 if is_subagent:
                                     # 子代理的工具结果
                                     yield {
@@ -336,70 +587,46 @@ async def process_agent(agent: Any, message: str):
                                         "id": msg.tool_call_id,
                                         "subagent": subagent_name,
                                     }
-                                elif tool_name == "task":
-                                    # task 工具完成 = 子代理完成
-                                    # 产出子代理完成事件（包含最终结果摘要）
-                                    yield {
-                                        "type": "sub_agent_end",
-                                        "content": msg.content,
-                                        "id": msg.tool_call_id,
-                                    }
-                                    # 清除当前活动的子代理名称
-                                    state["current_subagent"] = None
                                 else:
-                                    # 普通工具结果
-                                    yield {
-                                        "type": "tool_result",
-                                        "content": msg.content,
-                                        "id": msg.tool_call_id,
-                                    }
-                                    
-                                    # ---- 处理 read_image 工具返回的图片内容 ----
-                                    if tool_name == "read_image":
-                                        try:
-                                            # 工具返回的是带有 __vlm_image__ 标记的 JSON
-                                            content = msg.content
-                                            image_content = None
-                                            
-                                            # 解析 JSON 格式的工具返回值
-                                            if isinstance(content, str):
-                                                try:
-                                                    parsed = json.loads(content)
-                                                    # 检查是否有 __vlm_image__ 标记
-                                                    if isinstance(parsed, dict) and parsed.get('__vlm_image__'):
-                                                        image_content = parsed.get('content')
-                                                except json.JSONDecodeError:
-                                                    pass
-                                            elif isinstance(content, dict) and content.get('__vlm_image__'):
-                                                image_content = content.get('content')
-                                            
-                                            # 如果成功解析到图片内容，注入 HumanMessage
-                                            if image_content:
-                                                image_message = HumanMessage(content=image_content)
-                                                await agent.aupdate_state(
-                                                    config=config,
-                                                    values={"messages": [image_message]}
-                                                )
-
-                                        except Exception as e:
-                                            yield {
-                                                "type": "error",
-                                                "content": f"Failed to inject image message: {e}"
-                                            }
+                                    handler = _TOOL_RESULT_HANDLERS.get(msg.name or '', _on_tool_result)
+                                    for event in handler(run, msg):
+                                        yield event
  
             except Exception as e:
-                import traceback
+                # 先输出已合并但尚未发出的文本，保持事件顺序
+                event = run.flush_text()
+                if event is not None:
+                    yield event
                 yield {
                     "type": "error",
-                    "content": f'[process_agent] Inner exception: {e}\n[process_agent] Traceback:\n{traceback.format_exc()}',
+                    "content": f'[process_agent] Inner exception: {type(e).__name__}: {e}',
+                    "traceback": LazyTraceback(e) if _DEBUG else None,
                 }
     
     except Exception as e:
-        import traceback
+        event = run.flush_text()
+        if event is not None:
+            yield event
         yield {
             "type": "error",
-            "content": f'[process_agent] Error: {e}\n[process_agent] Traceback: {traceback.format_exc()}',
+            "content": f'[process_agent] Error: {e}',
+            "traceback": LazyTraceback(e),
         }
+    
+    # 输出流结束时残留的文本
+    event = run.flush_text()
+    if event is not None:
+        yield event
+    
+    # 返回前确保所有图片注入已完成
+    if run.pending_updates:
+        results = await asyncio.gather(*run.pending_updates, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                yield {
+                    "type": "error",
+                    "content": f"Failed to inject image message: {result}"
+                }
 
 async def ChatStream(
     model_name: str,
@@ -409,6 +636,7 @@ async def ChatStream(
     human_message: str = "", 
 ):
     """chat stream"""
+    global _major_agent
     
     try:
         # 验证输入
@@ -419,26 +647,29 @@ async def ChatStream(
             }
             return    
         # 初始化资源
-        global _store, _checkpoint, _major_agent
-        if _store is None or _checkpoint is None:
-            if not await init_resources():
-                yield {
-                    "type": "error", 
-                    "content": "Failed to initialize database"
-                }
-                return
+        if not await ensure_resources():
+            yield {
+                "type": "error", 
+                "content": "Failed to initialize database"
+            }
+            return
         
-        agent = None
-
-        if _major_agent is not None:
-            agent = _major_agent
-        else:
-            agent = await build_agent(
-                model_name, 
-                base_url, 
-                api_key, 
-                system_prompt          
-            )
+        agent_key = (model_name, base_url, api_key, system_prompt, get_config_stamp())
+        agent = _major_agent[1] if _major_agent is not None and _major_agent[0] == agent_key else None
+        if agent is None:
+            async with _major_agent_lock:
+                # 等锁期间可能已由其他调用构建完成
+                if _major_agent is not None and _major_agent[0] == agent_key:
+                    agent = _major_agent[1]
+                else:
+                    agent = await build_agent(
+                        model_name, 
+                        base_url, 
+                        api_key, 
+                        system_prompt          
+                    )
+                    if agent:
+                        _major_agent = (agent_key, agent)
         
         if not agent:
             yield {
@@ -449,123 +680,44 @@ async def ChatStream(
         
         # 处理代理流
         async for message in process_agent(agent, human_message):
-            if message["type"] == "model_answer":
-                yield {
-                    "type": "model_answer",
-                    "content": message["content"]
-                }
-            elif message["type"] == "model_thinking":
-                yield {
-                    "type": "model_thinking",
-                    "content": message["content"]
-                }
-            elif message["type"] == "tool_call":
-                yield {
-                    "type": "tool_call",
-                    "content": json.dumps({
-                        "name": message["name"],
-                        "args": message["args"],
-                        "id": message["id"]
-                    }, ensure_ascii=False)
-                }
-            elif message["type"] == "tool_result":
-                yield {
-                    "type": "tool_result",
-                    "content": json.dumps({
-                        "content": message["content"],
-                        "id": message["id"]
-                    }, ensure_ascii=False)
-                }
-            # ---- 子代理生命周期事件 ----
-            elif message["type"] == "sub_agent_start":
-                yield {
-                    "type": "sub_agent_start",
-                    "subagent": message.get("subagent"),
-                    "task": message.get("task"),
-                    "id": message.get("id")
-                }
-            elif message["type"] == "sub_agent_end":
-                yield {
-                    "type": "sub_agent_end",
-                    "content": message["content"],
-                    "id": message.get("id")
-                }
-            # ---- 子代理流式输出 ----
-            elif message["type"] == "sub_agent_answer":
-                yield {
-                    "type": "sub_agent_answer",
-                    "content": message["content"],
-                    "subagent": message.get("subagent")
-                }
-            elif message["type"] == "sub_agent_thinking":
-                yield {
-                    "type": "sub_agent_thinking",
-                    "content": message["content"],
-                    "subagent": message.get("subagent")
-                }
-            elif message["type"] == "sub_agent_tool_call":
-                yield {
-                    "type": "sub_agent_tool_call",
-                    "content": json.dumps({
-                        "name": message["name"],
-                        "args": message["args"],
-                        "id": message["id"],
-                        "subagent": message.get("subagent")
-                    }, ensure_ascii=False)
-                }
-            elif message["type"] == "sub_agent_tool_result":
-                yield {
-                    "type": "sub_agent_tool_result",
-                    "content": json.dumps({
-                        "content": message["content"],
-                        "id": message["id"],
-                        "subagent": message.get("subagent")
-                    }, ensure_ascii=False)
-                }
-            elif message["type"] == "error":
-                yield {
-                    "type": "error",
-                    "content": message["content"]
-                }
+            # 事件结构与 process_agent 一致（工具事件为结构化字段），直接透传
+            if message["type"] in _PASSTHROUGH_EVENTS:
+                yield message
                 
     except Exception as e:
-        import traceback
         yield {
             "type": "error", 
-            "content": f'[ChatStream] Error: {e}\n[ChatStream] Traceback:\n{traceback.format_exc()}',
+            "content": f'[ChatStream] Error: {e}',
+            "traceback": LazyTraceback(e),
         }
 
 async def cleanup_resources():
     """清理数据库资源"""
-    global _store, _checkpoint
+    global _store, _checkpoint, _major_agent
     try:
-        # 关闭 store
+        # 停止 store 的后台任务
         if _store:
             try:
                 if hasattr(_store, "_task") and _store._task:
                     _store._task.cancel()
                     try:
-                        await _store._task
-                    except:
+                        # 任务卡在长 SQL 时不无限等待，超时后直接关闭连接
+                        await asyncio.wait_for(_store._task, timeout=_STORE_TASK_STOP_TIMEOUT)
+                    except (asyncio.CancelledError, asyncio.TimeoutError):
                         pass
-                if hasattr(_store, "conn") and _store.conn:
-                    await _store.conn.close()
-                    cprint("[cleanup] Store connection closed", Colors.OKGREEN)
             except Exception as e:
-                cprint(f"[cleanup] Error closing store: {e}", Colors.WARNING)
+                cprint(f"[cleanup] Error stopping store task: {e}", Colors.WARNING)
         
-        # 关闭 checkpoint
-        if _checkpoint:
-            try:
-                if hasattr(_checkpoint, "conn") and _checkpoint.conn:
-                    await _checkpoint.conn.close()
-                    cprint("[cleanup] Checkpoint connection closed", Colors.OKGREEN)
-            except Exception as e:
-                cprint(f"[cleanup] Error closing checkpoint: {e}", Colors.WARNING)
+        # 关闭 store / checkpoint 共用的连接池
+        if _CONN_POOL:
+            await _close_conn_pool()
+            cprint("[cleanup] Database connections closed", Colors.OKGREEN)
         
-        # 重置全局变量
+        # 重置全局变量（已构建的 agent 持有旧连接，一并丢弃）
         _store = None
         _checkpoint = None
+        _major_agent = None
+        _SUB_AGENTS.clear()
             
     except Exception as e:
         cprint(f"[cleanup] Error during cleanup: {e}", Colors.WARNING)
\ No newline at end of file
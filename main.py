@@ -14,6 +14,7 @@ from chat.chat import ChatStream, cleanup_resources
 import asyncio
 import sys
 import time
+import traceback
 from rich.console import Console
 from rich.panel import Panel
 from rich.table import Table
@@ -21,9 +22,15 @@ from rich import box
 from rich.status import Status
 from prompt_toolkit.formatted_text import FormattedText
 from prompt_toolkit.styles import Style
-from utils.shell_prompt import CaptainShell, get_cached_system_commands
+from utils.shell_prompt import CaptainShell
 from pathlib import Path
 
+try:
+    # uvloop 仅支持 Linux/macOS，未安装时使用默认事件循环
+    import uvloop
+except ImportError:
+    uvloop = None
+
 # import ssl
 # import urllib3
 
@@ -78,10 +85,6 @@ async def main():
 
     # 初始化加载
     with Status("[bold cyan]Initializing Captain...", console=console, spinner="dots") as status:
-        # 预加载系统命令缓存
-        status.update("[bold cyan]Loading system commands...")
-        get_cached_system_commands()
-        
         # 初始化配置
         status.update("[bold cyan]Loading configuration...")
         set_toml_path(args.config)
@@ -267,7 +270,6 @@ async def main():
                     border_style="red",
                     box=box.ROUNDED
                 ))
-                import traceback
                 console.print(traceback.format_exc())
                 continue
     
@@ -280,7 +282,6 @@ async def main():
             border_style="red",
             box=box.ROUNDED
         ))
-        import traceback
         console.print(traceback.format_exc())
         sys.exit(1)
     finally:
@@ -290,7 +291,10 @@ async def main():
 if __name__ == "__main__":
     console = Console()
     try:
-        asyncio.run(main())
+        if uvloop is not None:
+            uvloop.run(main())
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         console.print("\n[bold green]👋 Goodbye![/bold green]")
     except Exception as e:
@@ -300,7 +304,6 @@ if __name__ == "__main__":
             border_style="red",
             box=box.ROUNDED
         ))
-        import traceback
         console.print(traceback.format_exc())
     finally:
         time.sleep(0.1)
\ No newline at end of file
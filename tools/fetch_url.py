@@ -1,8 +1,225 @@
+import threading
+import time
+from collections import OrderedDict
 from langchain.tools import tool
-from typing import Annotated
+from typing import Annotated, NamedTuple
 from pydantic import Field
 import requests
-from bs4 import BeautifulSoup, Tag
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, FeatureNotFound, Tag
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # selectolax is optional; fall back to BeautifulSoup/lxml
+    LexborHTMLParser = None
+
+
+# Shared session: keep-alive connections are reused across calls to the same host
+_session = requests.Session()
+_session.headers.update({
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+})
+_adapter = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504)),
+)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+
+# Stop reading the body once we have enough HTML for max_content_length characters of text
+# (pages often carry hundreds of KB of inline scripts/styles before the content, hence the floor)
+_HTML_TO_TEXT_RATIO = 8
+_MIN_HTML_BYTES = 512 * 1024
+_MAX_HTML_BYTES = 2 * 1024 * 1024
+_READ_CHUNK_SIZE = 64 * 1024
+
+# Boilerplate elements dropped before extracting text, and the containers tried (in order)
+# for the main content before falling back to <body>
+_STRIPPED_TAGS = ["script", "style", "nav", "footer", "header", "aside"]
+_CONTENT_SELECTORS = ["main", "article", '[role="main"]', ".content", "#content", ".post", ".article"]
+
+# Parsed results of recent fetches, keyed on (url, max_content_length). Entries younger than
+# _CACHE_FRESH_SECONDS are returned without touching the network; older ones are revalidated
+# with If-None-Match / If-Modified-Since when the server sent validators
+_CACHE_MAX_ENTRIES = 128
+_CACHE_FRESH_SECONDS = 300
+
+
+class _CachedPage(NamedTuple):
+    result: str
+    etag: str | None
+    last_modified: str | None
+    fetched_at: float
+
+
+_page_cache: "OrderedDict[tuple[str, int], _CachedPage]" = OrderedDict()
+_page_cache_lock = threading.Lock()
+
+
+def _cache_get(key: tuple[str, int]) -> _CachedPage | None:
+    with _page_cache_lock:
+        entry = _page_cache.get(key)
+        if entry is not None:
+            _page_cache.move_to_end(key)
+        return entry
+
+
+def _cache_put(key: tuple[str, int], entry: _CachedPage) -> None:
+    with _page_cache_lock:
+        _page_cache[key] = entry
+        _page_cache.move_to_end(key)
+        while len(_page_cache) > _CACHE_MAX_ENTRIES:
+            _page_cache.popitem(last=False)
+
+
+def _read_capped(response: requests.Response, limit: int) -> bytes:
+    """Read at most ``limit`` bytes of the (decompressed) response body."""
+    buf = bytearray()
+    for chunk in response.iter_content(chunk_size=_READ_CHUNK_SIZE):
+        buf += chunk
+        if len(buf) >= limit:
+            break
+    return bytes(buf[:limit])
+
+
+def _parse_html(markup: bytes, from_encoding: str | None = None) -> BeautifulSoup:
+    """Parse HTML with the C-based lxml parser, falling back to html.parser if lxml is missing.
+
+    Raw bytes are passed so the parser can honour the document's own <meta charset>.
+    """
+    try:
+        return BeautifulSoup(markup, "lxml", from_encoding=from_encoding)
+    except FeatureNotFound:
+        return BeautifulSoup(markup, "html.parser", from_encoding=from_encoding)
+
+
+def _extract_title_and_description(soup: BeautifulSoup) -> tuple[str, str]:
+    """Collect the page title and meta description in a single pass over <title>/<meta> tags.
+
+    Falls back to the Open Graph description when the first name="description" tag is
+    missing or empty.
+    """
+    title_tag = None
+    meta_desc = None
+    og_desc = None
+    for tag in soup.find_all(["title", "meta"]):
+        if not isinstance(tag, Tag):
+            continue
+        if tag.name == "title":
+            if title_tag is None:
+                title_tag = tag
+        elif meta_desc is None and tag.get("name") == "description":
+            meta_desc = tag
+        elif og_desc is None and tag.get("property") == "og:description":
+            og_desc = tag
+    
+    title = title_tag.get_text(strip=True) if title_tag is not None else ""
+    
+    description = _meta_content(meta_desc) or _meta_content(og_desc)
+    return title, description
+
+
+def _meta_content(tag: Tag | None) -> str:
+    """Return a <meta> tag's content attribute, or "" if the tag or attribute is missing."""
+    if tag is None:
+        return ""
+    content = tag.get("content")
+    return content if isinstance(content, str) else ""
+
+
+def _extract_with_soup(html: bytes, declared_encoding: str | None) -> tuple[str, str, str]:
+    """Extract title, description and main text with BeautifulSoup."""
+    soup = _parse_html(html, declared_encoding)
+    
+    # Remove script and style elements
+    for element in soup(_STRIPPED_TAGS):
+        element.decompose()
+    
+    # Extract title and meta description
+    title, description = _extract_title_and_description(soup)
+    
+    # Extract main content
+    # Try common content containers first
+    main_content = None
+    for selector in _CONTENT_SELECTORS:
+        main_content = soup.select_one(selector)
+        if main_content:
+            break
+    
+    # If no main content found, use body
+    if not main_content:
+        main_content = soup.body if soup.body else soup
+    
+    return title, description, main_content.get_text(separator="\n", strip=True)
+
+
+def _extract_with_selectolax(html: bytes, declared_encoding: str | None) -> tuple[str, str, str]:
+    """Extract title, description and main text with selectolax's C (lexbor) parser.
+
+    Mirrors _extract_with_soup: same stripped tags, same description fallback and the same
+    content-container priority.
+    """
+    tree = None
+    if declared_encoding:
+        try:
+            tree = LexborHTMLParser(html.decode(declared_encoding, errors="replace"))
+        except LookupError:
+            pass
+    if tree is None:
+        # Let lexbor honour the BOM / <meta charset>
+        tree = LexborHTMLParser(html, encoding=True)
+    
+    tree.strip_tags(_STRIPPED_TAGS)
+    
+    title_node = tree.css_first("title")
+    title = title_node.text(strip=True) if title_node is not None else ""
+    
+    description = ""
+    for selector in ('meta[name="description"]', 'meta[property="og:description"]'):
+        node = tree.css_first(selector)
+        if node is not None:
+            description = node.attributes.get("content") or ""
+            if description:
+                break
+    
+    main_content = None
+    for selector in _CONTENT_SELECTORS:
+        main_content = tree.css_first(selector)
+        if main_content is not None:
+            break
+    if main_content is None:
+        main_content = tree.body if tree.body is not None else tree.root
+    
+    text = main_content.text(separator="\n", strip=True) if main_content is not None else ""
+    return title, description, text
+
+
+def _extract_page(html: bytes, declared_encoding: str | None) -> tuple[str, str, str]:
+    """Return (title, description, main text) of an HTML page, using selectolax when installed."""
+    if LexborHTMLParser is not None:
+        return _extract_with_selectolax(html, declared_encoding)
+    return _extract_with_soup(html, declared_encoding)
+
+
+def _clean_and_truncate(text: str, max_length: int) -> str:
+    """Drop blank lines, strip the rest and cut the result to ``max_length`` characters.
+
+    Stops collecting lines as soon as the limit is passed, so the discarded tail of a long
+    page is never stripped or joined.
+    """
+    lines = []
+    length = -1  # no newline before the first line
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        lines.append(line)
+        length += len(line) + 1
+        if length > max_length:
+            return "\n".join(lines)[:max_length] + "\n...(truncated)"
+    return "\n".join(lines)
 
 
 @tool(description="Fetch and extract text content from a URL. Returns title, description, and main text content.")
@@ -11,64 +228,46 @@ def fetch_url(
     timeout: Annotated[int, Field(default=30, description="Request timeout in seconds")] = 30,
     max_content_length: Annotated[int, Field(default=10000, description="Maximum content length to return")] = 10000
 ) -> str:
-    """Fetch URL content and extract readable text using BeautifulSoup."""
+    """Fetch URL content and extract readable text (selectolax when installed, otherwise BeautifulSoup)."""
+    cache_key = (url, max_content_length)
+    cached = _cache_get(cache_key)
+    if cached is not None and time.monotonic() - cached.fetched_at < _CACHE_FRESH_SECONDS:
+        return cached.result
+    
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+    
     try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-        }
-        
-        response = requests.get(url, headers=headers, timeout=timeout)
-        response.raise_for_status()
-        
-        # Try to detect encoding
-        if response.encoding is None or response.encoding == 'ISO-8859-1':
-            response.encoding = response.apparent_encoding
-        
-        soup = BeautifulSoup(response.text, "html.parser")
-        
-        # Remove script and style elements
-        for element in soup(["script", "style", "nav", "footer", "header", "aside"]):
-            element.decompose()
-        
-        # Extract title
-        title = ""
-        if soup.title:
-            title = soup.title.get_text(strip=True)
-        
-        # Extract meta description
-        description = ""
-        meta_desc = soup.find("meta", attrs={"name": "description"})
-        if isinstance(meta_desc, Tag) and meta_desc.get("content"):
-            description = str(meta_desc.get("content", ""))
-        
-        # Try Open Graph description as fallback
-        if not description:
-            og_desc = soup.find("meta", attrs={"property": "og:description"})
-            if isinstance(og_desc, Tag) and og_desc.get("content"):
-                description = str(og_desc.get("content", ""))
-        
-        # Extract main content
-        # Try common content containers first
-        main_content = None
-        for selector in ["main", "article", '[role="main"]', ".content", "#content", ".post", ".article"]:
-            main_content = soup.select_one(selector)
-            if main_content:
-                break
-        
-        # If no main content found, use body
-        if not main_content:
-            main_content = soup.body if soup.body else soup
-        
-        # Get text content
-        text = main_content.get_text(separator="\n", strip=True)
+        with _session.get(url, timeout=timeout, stream=True, headers=headers) as response:
+            if response.status_code == 304 and cached is not None:
+                _cache_put(cache_key, cached._replace(fetched_at=time.monotonic()))
+                return cached.result
+            response.raise_for_status()
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            
+            # Only trust an explicit charset from the headers; requests defaults text/* to
+            # ISO-8859-1, in which case let the parser detect it instead of running
+            # apparent_encoding over the whole body
+            declared_encoding = response.encoding
+            if declared_encoding == 'ISO-8859-1':
+                declared_encoding = None
+            
+            # Truncated HTML is fine for the parser, so skip the tail of very large pages
+            byte_limit = min(
+                max(max_content_length * _HTML_TO_TEXT_RATIO, _MIN_HTML_BYTES),
+                _MAX_HTML_BYTES,
+            )
+            html = _read_capped(response, byte_limit)
         
-        # Clean up whitespace
-        lines = [line.strip() for line in text.splitlines() if line.strip()]
-        text = "\n".join(lines)
+        title, description, text = _extract_page(html, declared_encoding)
         
-        # Truncate if too long
-        if len(text) > max_content_length:
-            text = text[:max_content_length] + "\n...(truncated)"
+        # Clean up whitespace and truncate if too long
+        text = _clean_and_truncate(text, max_content_length)
         
         # Build result
         result_parts = []
@@ -79,7 +278,9 @@ def fetch_url(
             result_parts.append(f"Description: {description}")
         result_parts.append(f"\nContent:\n{text}")
         
-        return "\n".join(result_parts)
+        result = "\n".join(result_parts)
+        _cache_put(cache_key, _CachedPage(result, etag, last_modified, time.monotonic()))
+        return result
         
     except requests.Timeout:
         return f"Error: Request timed out after {timeout} seconds"
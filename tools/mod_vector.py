@@ -5,6 +5,8 @@
 
 import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Annotated, Optional
 from pathlib import Path
 
@@ -17,6 +19,13 @@ from utils.utils import get_embeddings_config, get_vector_db_path
 from tools.vector_markdown import split_markdown, Chunk
 
 
+# ChromaDB collection 名称中不允许的字符
+_COLLECTION_NAME_RE = re.compile(r'[^a-zA-Z0-9_-]')
+
+# 同时进行中的写入批次数：嵌入请求与 Chroma 写入相互重叠，再多收益递减
+_MAX_INFLIGHT_BATCHES = 3
+
+
 # ============== 嵌入模型初始化 ==============
 
 _embeddings = None
@@ -40,22 +49,37 @@ def _get_embeddings():
     return _embeddings
 
 
+# Chroma 实例缓存: (vector_db_path, collection_name) -> Chroma
+_chroma_clients: dict[tuple[str, str], Chroma] = {}
+_chroma_lock = threading.Lock()
+
+
 def _get_chroma_client(collection_name: str):
-    """获取 ChromaDB 客户端"""
+    """获取 ChromaDB 客户端（按数据库路径与集合名缓存）"""
     vector_db_path = get_vector_db_path()
     if not vector_db_path:
         raise RuntimeError("Vector DB path not configured. Please set workspace path first.")
     
-    # 确保目录存在
-    os.makedirs(vector_db_path, exist_ok=True)
+    key = (vector_db_path, collection_name)
+    chroma = _chroma_clients.get(key)
+    if chroma is not None:
+        return chroma
     
-    embeddings = _get_embeddings()
-    
-    return Chroma(
-        collection_name=collection_name,
-        embedding_function=embeddings,
-        persist_directory=vector_db_path
-    )
+    with _chroma_lock:
+        chroma = _chroma_clients.get(key)
+        if chroma is None:
+            # 确保目录存在
+            os.makedirs(vector_db_path, exist_ok=True)
+            
+            embeddings = _get_embeddings()
+            
+            chroma = Chroma(
+                collection_name=collection_name,
+                embedding_function=embeddings,
+                persist_directory=vector_db_path
+            )
+            _chroma_clients[key] = chroma
+    return chroma
 
 
 # ============== CLI 直接调用函数 ==============
@@ -64,7 +88,8 @@ def cli_store_markdown(
     file_path: str,
     collection_name: Optional[str] = None,
     chunk_size: int = 600,
-    chunk_overlap: int = 100
+    chunk_overlap: int = 100,
+    batch_size: int = 128
 ) -> str:
     """
     CLI 直接调用：将 Markdown 文件切分并存入向量数据库
@@ -75,6 +100,7 @@ def cli_store_markdown(
         collection_name: 集合名称（可选，默认用文件名）
         chunk_size: 切片大小（字符数），默认 600
         chunk_overlap: 切片重叠大小，默认 100
+        batch_size: 每批写入的切片数，默认 128（嵌入请求与 Chroma 写入按批进行）
     
     Returns:
         执行结果字符串
@@ -98,7 +124,7 @@ def cli_store_markdown(
         collection_name = Path(file_path).stem
     
     # 清理 collection 名称（ChromaDB 要求）
-    collection_name = re.sub(r'[^a-zA-Z0-9_-]', '_', collection_name)
+    collection_name = _COLLECTION_NAME_RE.sub('_', collection_name)
     if len(collection_name) < 3:
         collection_name = f"doc_{collection_name}"
     
@@ -114,18 +140,38 @@ def cli_store_markdown(
         return "Error: No chunks generated from the document"
     
     # 存入向量数据库
+    stored = 0
     try:
         chroma = _get_chroma_client(collection_name)
         
         texts = [chunk.content for chunk in chunks]
         metadatas = [chunk.metadata for chunk in chunks]
         
-        chroma.add_texts(texts=texts, metadatas=metadatas)
+        # 分批写入，避免单次嵌入请求/写入事务过大
+        # 多个批次并发执行，某批写入 Chroma 时下一批的嵌入请求已在进行
+        batch_size = max(1, batch_size)
+        with ThreadPoolExecutor(max_workers=_MAX_INFLIGHT_BATCHES) as executor:
+            futures = {
+                executor.submit(
+                    chroma.add_texts,
+                    texts=texts[start:start + batch_size],
+                    metadatas=metadatas[start:start + batch_size],
+                ): len(texts[start:start + batch_size])
+                for start in range(0, len(texts), batch_size)
+            }
+            try:
+                for future in as_completed(futures):
+                    future.result()
+                    stored += futures[future]
+            except Exception:
+                for pending in futures:
+                    pending.cancel()
+                raise
         
         return f"Successfully stored {len(chunks)} chunks from '{file_path}' into collection '{collection_name}'"
     
     except Exception as e:
-        return f"Error storing to vector DB: {e}"
+        return f"Error storing to vector DB after {stored}/{len(chunks)} chunks: {e}"
 
 
 def cli_list_collections() -> str:
@@ -174,7 +220,7 @@ def cli_rag(collection_name: str, query: str, top_k: int = 5) -> tuple[bool, str
         (success, context, enhanced_prompt): 成功标志、检索到的上下文、增强后的提示词
     """
     # 清理 collection 名称
-    collection_name = re.sub(r'[^a-zA-Z0-9_-]', '_', collection_name)
+    collection_name = _COLLECTION_NAME_RE.sub('_', collection_name)
     
     try:
         chroma = _get_chroma_client(collection_name)
@@ -247,7 +293,7 @@ def search_vectors(
         return "Error: Query cannot be empty"
     
     # 清理 collection 名称
-    collection_name = re.sub(r'[^a-zA-Z0-9_-]', '_', collection_name)
+    collection_name = _COLLECTION_NAME_RE.sub('_', collection_name)
     
     try:
         chroma = _get_chroma_client(collection_name)
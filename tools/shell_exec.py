@@ -1,13 +1,17 @@
-from langchain.tools import tool
+from langchain_core.tools import StructuredTool
+import asyncio
+import os
+import signal
 import subprocess
 import sys
 import locale
 from typing import Annotated
 from pydantic import Field
-from utils.utils import get_workspace_path
-from pathlib import Path
+from utils.utils import get_workspace_root
 
-def _get_shell_encoding() -> str:
+_SHELL_TIMEOUT = 30
+
+def _detect_shell_encoding() -> str:
     """Get the appropriate encoding for shell output."""
     if sys.platform == 'win32':
         # On Windows, use the console output code page (usually GBK for Chinese Windows)
@@ -18,29 +22,61 @@ def _get_shell_encoding() -> str:
             return locale.getpreferredencoding(False)
     return 'utf-8'
 
-@tool(description="Execute a shell command and return the output")
-def shell_exec(
+# Fixed for the life of the process, so detect it once at import
+_SHELL_ENCODING = _detect_shell_encoding()
+
+def _decode(data: bytes, encoding: str) -> str:
+    """Decode shell output the way text=True would (errors replaced, newlines normalized)."""
+    return data.decode(encoding, errors='replace').replace('\r\n', '\n').replace('\r', '\n')
+
+def _kill(process: asyncio.subprocess.Process) -> None:
+    """Kill the shell and, on POSIX, every process it started."""
+    try:
+        if sys.platform == 'win32':
+            process.kill()
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+async def shell_exec_async(
     command: Annotated[str, Field(description="The shell command to execute")]
 ) -> str:
     try:
-        encoding = _get_shell_encoding()
-        result = subprocess.run(
+        process = await asyncio.create_subprocess_shell(
             command,
-            shell=True,
-            cwd=Path(get_workspace_path()).resolve(),   # 使用绝对路径
-            capture_output=True,
-            text=True,
-            encoding=encoding,
-            errors='replace',  # Handle encoding errors gracefully
-            timeout=30
+            cwd=get_workspace_root(),   # 使用绝对路径（解析结果已缓存）
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            # 独立进程组，超时时可以连同子进程一起结束
+            start_new_session=sys.platform != 'win32',
         )
-        if result.returncode == 0:
-            return result.stdout if result.stdout else "(no output)"
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), _SHELL_TIMEOUT)
+        except asyncio.TimeoutError:
+            _kill(process)
+            await process.wait()
+            return "Error: Command timed out"
+        except asyncio.CancelledError:
+            _kill(process)
+            raise
+
+        if process.returncode == 0:
+            return _decode(stdout, _SHELL_ENCODING) if stdout else "(no output)"
         else:
-            return f"Error: {result.stderr}" if result.stderr else f"Error: Command failed with code {result.returncode}"
-    except subprocess.TimeoutExpired:
-        return "Error: Command timed out"
-    except subprocess.CalledProcessError as e:
-        return f"Error: {e.stderr}"
+            return f"Error: {_decode(stderr, _SHELL_ENCODING)}" if stderr else f"Error: Command failed with code {process.returncode}"
     except Exception as e:
-        return f"Error: {str(e)}"
\ No newline at end of file
+        return f"Error: {str(e)}"
+
+def _shell_exec(
+    command: Annotated[str, Field(description="The shell command to execute")]
+) -> str:
+    """同步调用入口（无事件循环的线程中使用）"""
+    return asyncio.run(shell_exec_async(command))
+
+shell_exec = StructuredTool.from_function(
+    func=_shell_exec,
+    coroutine=shell_exec_async,
+    name="shell_exec",
+    description="Execute a shell command and return the output",
+)
@@ -4,6 +4,7 @@ Markdown 文档解析和切分模块
 """
 
 from dataclasses import dataclass, field
+from functools import lru_cache
 
 import mistune
 from langchain_text_splitters import RecursiveCharacterTextSplitter
@@ -16,7 +17,8 @@ class Section:
     """Markdown section 节点"""
     title: str
     level: int  # 标题层级 1-6, 0 表示根节点
-    content: str = ""  # 该 section 的正文内容（不含子 section）
+    # 该 section 的正文段落（不含子 section），收集时才拼接为字符串
+    content: list[str] = field(default_factory=list)
     children: list["Section"] = field(default_factory=list)
     title_path: str = ""  # 标题路径，如 "一级标题 > 二级标题"
 
@@ -37,7 +39,9 @@ class MarkdownSectionParser:
     """
     
     def __init__(self):
-        self.md = mistune.create_markdown(renderer=None)
+        # 只输出 AST，不加载语法扩展；speedup 用整段正则匹配普通段落和行内文本，
+        # 避免逐个规则试配（标题、段落以外的结构本模块并不关心）
+        self.md = mistune.create_markdown(renderer=None, plugins=["speedup"])
     
     def parse(self, markdown_text: str) -> Section:
         """
@@ -63,7 +67,7 @@ class MarkdownSectionParser:
             if token["type"] == "heading":
                 # 保存之前积累的内容到当前 section
                 if current_content_parts:
-                    stack[-1].content += "\n".join(current_content_parts)
+                    stack[-1].content.extend(current_content_parts)
                     current_content_parts = []
                 
                 level = token["attrs"]["level"]
@@ -91,18 +95,23 @@ class MarkdownSectionParser:
         
         # 保存最后的内容
         if current_content_parts:
-            stack[-1].content += "\n".join(current_content_parts)
+            stack[-1].content.extend(current_content_parts)
     
     def _extract_text(self, children: list) -> str:
-        """从 token children 中提取文本"""
+        """从 token children 中提取文本（显式栈先序遍历，不递归）"""
         if not children:
             return ""
         parts = []
-        for child in children:
-            if child["type"] == "text":
+        stack = list(reversed(children))
+        while stack:
+            child = stack.pop()
+            child_type = child["type"]
+            if child_type == "text":
                 parts.append(child["raw"])
-            elif "children" in child and child["children"]:
-                parts.append(self._extract_text(child["children"]))
+            elif child_type in ("softbreak", "linebreak"):
+                parts.append("\n")
+            elif child.get("children"):
+                stack.extend(reversed(child["children"]))
         return "".join(parts)
     
     def _token_to_text(self, token: dict) -> str:
@@ -150,20 +159,40 @@ class MarkdownSectionParser:
         return ""
 
 
+# ============== 共享实例 ==============
+
+# 解析器无状态（每次 parse 使用独立的解析 state），全局复用一个实例
+_PARSER = MarkdownSectionParser()
+
+
+@lru_cache(maxsize=8)
+def _get_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    """获取（按参数缓存的）递归字符切分器"""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=["\n\n", "\n", "。", ".", " ", ""],
+        keep_separator=True
+    )
+
+
 # ============== 切分函数 ==============
 
 def _collect_sections(section: Section, sections: list[tuple[str, str]]):
     """
-    递归收集所有 section 的内容和标题路径
+    按文档顺序（先序遍历）收集所有 section 的内容和标题路径
     Args:
-        section: 当前 section
+        section: 根 section
         sections: 收集结果列表 [(title_path, content), ...]
     """
-    if section.content.strip():
-        sections.append((section.title_path, section.content.strip()))
-    
-    for child in section.children:
-        _collect_sections(child, sections)
+    stack = [section]
+    while stack:
+        current = stack.pop()
+        if current.content:
+            content = "\n".join(current.content).strip()
+            if content:
+                sections.append((current.title_path, content))
+        stack.extend(reversed(current.children))
 
 
 def split_markdown(
@@ -187,20 +216,14 @@ def split_markdown(
         Chunk 列表
     """
     # 第一层：解析为 section 树
-    parser = MarkdownSectionParser()
-    root = parser.parse(markdown_text)
+    root = _PARSER.parse(markdown_text)
     
     # 收集所有 section
     sections: list[tuple[str, str]] = []
     _collect_sections(root, sections)
     
     # 第二层：对每个 section 进行切分
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        separators=["\n\n", "\n", "。", ".", " ", ""],
-        keep_separator=True
-    )
+    splitter = _get_splitter(chunk_size, chunk_overlap)
     
     chunks: list[Chunk] = []
     
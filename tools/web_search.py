@@ -1,10 +1,32 @@
+import threading
 from typing import Literal, Annotated
 from tavily import TavilyClient
-from utils.utils import get_model_config
+from utils.utils import get_tavily_api_key
+from utils import json_utils
 from langchain.tools import tool
 from pydantic import Field
 
 _tavily_client = None
+_tavily_lock = threading.Lock()
+
+
+def _get_tavily_client() -> TavilyClient:
+    """获取 Tavily 客户端（首次调用时读取配置并创建，之后复用）"""
+    global _tavily_client
+    client = _tavily_client
+    if client is not None:
+        return client
+
+    with _tavily_lock:
+        if _tavily_client is None:
+            tavily_api_key = get_tavily_api_key()
+            if tavily_api_key is None:
+                raise RuntimeError("Failed to load model config")
+            if not tavily_api_key:
+                raise RuntimeError("Tavily API key is not set")
+            _tavily_client = TavilyClient(api_key=tavily_api_key)
+    return _tavily_client
+
 
 @tool(description="Run a web search to find information")
 def internet_search(
@@ -13,21 +35,13 @@ def internet_search(
     topic: Annotated[Literal["general", "news", "finance"], Field(default="general", description="The topic of the search")],
     include_raw_content: Annotated[bool, Field(default=False, description="Whether to include raw content in the results")],
     include_answer: Annotated[bool, Field(default=False, description="Whether to include answer in the results")]
-):
-    global _tavily_client
-    if _tavily_client is None:
-        model_config = get_model_config()
-        if model_config == "Error: toml_path is None":
-            raise RuntimeError("Failed to load model config")
-        tavily_api_key = model_config.get("tavily_api_key", "")
-        if not tavily_api_key:
-            raise RuntimeError("Tavily API key is not set")
-        _tavily_client = TavilyClient(api_key=tavily_api_key)
-
-    return _tavily_client.search(
+) -> str:
+    response = _get_tavily_client().search(
         query,
         max_results=max_results,
         include_raw_content=include_raw_content,
         include_answer=include_answer,
         topic=topic,
-    )
\ No newline at end of file
+    )
+    # 直接序列化为字符串，避免工具包装层再用标准库 json 编码一次
+    return json_utils.dumps(response)
@@ -5,15 +5,13 @@
 
 from typing import Optional
 from dataclasses import dataclass
-from enum import Enum
 
 from utils.sys_shell import execute_shell_command
 from utils.utils import get_prompt, list_prompt_templates
-from tools.mod_vector import cli_store_markdown, cli_list_collections, cli_rag
 
 
-class CommandType(Enum):
-    """命令类型"""
+class CommandType:
+    """命令类型（普通字符串常量，比较和哈希不经过 Enum 的描述符开销）"""
     EXIT = "exit"           # 退出命令
     SHELL = "shell"         # shell 命令
     VECTOR = "vector"       # 向量命令
@@ -24,8 +22,8 @@ class CommandType(Enum):
     EMPTY = "empty"         # 空输入
 
 
-class ResultStyle(Enum):
-    """结果样式"""
+class ResultStyle:
+    """结果样式（普通字符串常量）"""
     SUCCESS = "success"     # 绿色
     ERROR = "error"         # 红色
     WARNING = "warning"     # 黄色
@@ -33,17 +31,96 @@ class ResultStyle(Enum):
     PROMPT = "prompt"       # 紫色（prompt 模板）
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class CommandResult:
-    """命令解析结果"""
-    cmd_type: CommandType
+    """命令解析结果（不可变，无实例 __dict__）"""
+    cmd_type: str  # CommandType 常量
     success: bool
     title: str
     output: str
-    style: ResultStyle
+    style: str  # ResultStyle 常量
     passthrough_msg: Optional[str] = None  # 传递给 agent 的消息
 
 
+# ============== 固定结果（不可变，直接复用同一实例） ==============
+
+# 空输入
+_EMPTY_RESULT = CommandResult(
+    cmd_type=CommandType.EMPTY,
+    success=True,
+    title="",
+    output="",
+    style=ResultStyle.INFO
+)
+
+# 退出命令
+_EXIT_RESULT = CommandResult(
+    cmd_type=CommandType.EXIT,
+    success=True,
+    title="👋 Goodbye!",
+    output="",
+    style=ResultStyle.SUCCESS
+)
+
+# 'shell' 后没有命令
+_SHELL_USAGE_RESULT = CommandResult(
+    cmd_type=CommandType.SHELL,
+    success=False,
+    title="⚠️ Shell Command",
+    output="Please provide a command after 'shell'",
+    style=ResultStyle.WARNING
+)
+
+# vector 命令用法
+_VECTOR_USAGE_RESULT = CommandResult(
+    cmd_type=CommandType.VECTOR,
+    success=False,
+    title="📖 Vector Command Usage",
+    output="""Usage:
+  vector list
+      List all collections in vector database.
+
+  vector store markdown {Path} <collection_name> <chunk_size> <chunk_overlap>
+      Store a Markdown file into vector database.
+      - {Path}             : Markdown file path (required)
+      - <collection_name>  : Collection name (default: filename)
+      - <chunk_size>       : Chunk size in chars (default: 600)
+      - <chunk_overlap>    : Overlap size in chars (default: 100)
+
+  vector rag {collection} {query} <top_k>
+      RAG: Retrieve relevant context and ask AI.
+      - {collection} : Collection name to search
+      - {query}      : Your question
+      - <top_k>      : Number of results (default: 5)""",
+    style=ResultStyle.WARNING
+)
+
+# vector rag 用法
+_RAG_USAGE_RESULT = CommandResult(
+    cmd_type=CommandType.VECTOR,
+    success=False,
+    title="📖 RAG Usage",
+    output="""Usage: vector rag {collection_name} {query} <top_k>
+  - {collection_name} : Collection name to search
+  - {query}           : Your question
+  - <top_k>           : Number of results (default: 5)""",
+    style=ResultStyle.WARNING
+)
+
+# vector store 用法
+_STORE_USAGE_RESULT = CommandResult(
+    cmd_type=CommandType.VECTOR,
+    success=False,
+    title="📖 Vector Store Usage",
+    output="""Usage: vector store markdown {Path} <collection_name> <chunk_size> <chunk_overlap>
+  - {Path}             : Markdown file path (required)
+  - <collection_name>  : Collection name (default: filename)
+  - <chunk_size>       : Chunk size in chars (default: 600)
+  - <chunk_overlap>    : Overlap size in chars (default: 100)""",
+    style=ResultStyle.WARNING
+)
+
+
 def parse_command(query: str) -> CommandResult:
     """
     统一解析用户输入的命令
@@ -58,49 +135,15 @@ def parse_command(query: str) -> CommandResult:
     
     # 空输入
     if not query:
-        return CommandResult(
-            cmd_type=CommandType.EMPTY,
-            success=True,
-            title="",
-            output="",
-            style=ResultStyle.INFO
-        )
+        return _EMPTY_RESULT
     
-    # 退出命令
-    if query.lower() in ["exit", "quit", "q"]:
-        return CommandResult(
-            cmd_type=CommandType.EXIT,
-            success=True,
-            title="👋 Goodbye!",
-            output="",
-            style=ResultStyle.SUCCESS
-        )
-    
-    # Shell 命令
-    if query.lower() == "shell" or query.lower().startswith("shell "):
-        command = query[6:].strip()
-        if not command:
-            return CommandResult(
-                cmd_type=CommandType.SHELL,
-                success=False,
-                title="⚠️ Shell Command",
-                output="Please provide a command after 'shell'",
-                style=ResultStyle.WARNING
-            )
-        
-        result = execute_shell_command(command)
-        return CommandResult(
-            cmd_type=CommandType.SHELL,
-            success=result["success"],
-            title=f"🖥️ Shell: {result['command']}",
-            output=result["output"],
-            style=ResultStyle.SUCCESS if result["success"] else ResultStyle.ERROR
-        )
-    
-    # Vector 命令
-    if query.lower() == "vector" or query.lower().startswith("vector "):
-        result = _parse_vector_command(query)
-        return result
+    # 内置命令：按首个词查表分发
+    head, _, rest = query.partition(" ")
+    handler = _COMMAND_HANDLERS.get(head.lower())
+    if handler is not None:
+        result = handler(rest.strip())
+        if result is not None:
+            return result
     
     # Prompt 模板命令
     if query.startswith("/"):
@@ -171,35 +214,60 @@ def parse_command(query: str) -> CommandResult:
     )
 
 
-def _parse_vector_command(command: str) -> CommandResult:
-    """解析 vector 命令"""
-    parts = command.split(maxsplit=3)  # 最多分割3次，保留 rag 的查询文本
+def _is_int(token: str) -> bool:
+    """token 是否为整数（允许 +/- 号）"""
+    return token.lstrip("+-").isdigit()
+
+
+def _parse_int_arg(token: str, name: str, minimum: int) -> tuple[int, Optional[str]]:
+    """
+    解析整数参数并检查下限
+    Returns:
+        (value, error): 解析成功时 error 为 None，否则 error 为错误信息
+    """
+    try:
+        value = int(token)
+    except ValueError:
+        return 0, f"Invalid {name}: {token} (must be integer)"
+    if value < minimum:
+        return 0, f"Invalid {name}: {token} (must be >= {minimum})"
+    return value, None
+
+
+def _handle_exit(args: str) -> Optional[CommandResult]:
+    """exit / quit / q（带参数时不是退出命令，交给后续处理）"""
+    if args:
+        return None
+    return _EXIT_RESULT
+
+
+def _handle_shell(command: str) -> CommandResult:
+    """shell {command}"""
+    if not command:
+        return _SHELL_USAGE_RESULT
     
-    if len(parts) < 2:
-        return CommandResult(
-            cmd_type=CommandType.VECTOR,
-            success=False,
-            title="📖 Vector Command Usage",
-            output="""Usage:
-  vector list
-      List all collections in vector database.
+    result = execute_shell_command(command)
+    return CommandResult(
+        cmd_type=CommandType.SHELL,
+        success=result["success"],
+        title=f"🖥️ Shell: {result['command']}",
+        output=result["output"],
+        style=ResultStyle.SUCCESS if result["success"] else ResultStyle.ERROR
+    )
 
-  vector store markdown {Path} <collection_name> <chunk_size> <chunk_overlap>
-      Store a Markdown file into vector database.
-      - {Path}             : Markdown file path (required)
-      - <collection_name>  : Collection name (default: filename)
-      - <chunk_size>       : Chunk size in chars (default: 600)
-      - <chunk_overlap>    : Overlap size in chars (default: 100)
 
-  vector rag {collection} {query} <top_k>
-      RAG: Retrieve relevant context and ask AI.
-      - {collection} : Collection name to search
-      - {query}      : Your question
-      - <top_k>      : Number of results (default: 5)""",
-            style=ResultStyle.WARNING
-        )
+def _parse_vector_command(args: str) -> CommandResult:
+    """解析 vector 命令（args 为 'vector' 之后的部分）"""
+    # 只分割一次，各子命令直接按位置取参数
+    parts = args.split()
     
-    action = parts[1].lower()
+    if not parts:
+        return _VECTOR_USAGE_RESULT
+    
+    action = parts[0].lower()
+    
+    # 向量库依赖（Chroma/Embeddings）导入较慢，仅在执行 vector 命令时加载
+    from tools.mod_vector import cli_store_markdown, cli_list_collections, cli_rag
     
     # vector list - 列出所有集合
     if action == "list":
@@ -215,36 +283,25 @@ def _parse_vector_command(command: str) -> CommandResult:
     
     # vector rag {collection} {query} [top_k] - RAG 检索
     if action == "rag":
-        if len(parts) < 4:
-            return CommandResult(
-                cmd_type=CommandType.VECTOR,
-                success=False,
-                title="📖 RAG Usage",
-                output="""Usage: vector rag {collection_name} {query} <top_k>
-  - {collection_name} : Collection name to search
-  - {query}           : Your question
-  - <top_k>           : Number of results (default: 5)""",
-                style=ResultStyle.WARNING
-            )
+        if len(parts) < 3:
+            return _RAG_USAGE_RESULT
         
-        collection_name = parts[2]
-        # 重新分割以获取 query 和 top_k
-        rag_parts = command.split(maxsplit=4)
-        query = rag_parts[3] if len(rag_parts) > 3 else ""
+        collection_name = parts[1]
         
-        # 解析 top_k
+        # query 可以包含多个词；最后一个词是整数时作为 top_k
+        query_parts = parts[2:]
         top_k = 5
-        if len(rag_parts) > 4:
-            try:
-                top_k = int(rag_parts[4])
-            except ValueError:
+        if len(query_parts) > 1 and _is_int(query_parts[-1]):
+            top_k, error = _parse_int_arg(query_parts.pop(), "top_k", 1)
+            if error is not None:
                 return CommandResult(
                     cmd_type=CommandType.VECTOR,
                     success=False,
                     title="❌ RAG Error",
-                    output=f"Invalid top_k: {rag_parts[4]} (must be integer)",
+                    output=error,
                     style=ResultStyle.ERROR
                 )
+        query = " ".join(query_parts)
         
         success, context, enhanced_prompt = cli_rag(collection_name, query, top_k)
         
@@ -269,23 +326,10 @@ def _parse_vector_command(command: str) -> CommandResult:
     
     # vector store markdown {path} ... - 存储 markdown
     if action == "store":
-        # 重新分割以获取所有参数
-        store_parts = command.split()
+        if len(parts) < 3:
+            return _STORE_USAGE_RESULT
         
-        if len(store_parts) < 4:
-            return CommandResult(
-                cmd_type=CommandType.VECTOR,
-                success=False,
-                title="📖 Vector Store Usage",
-                output="""Usage: vector store markdown {Path} <collection_name> <chunk_size> <chunk_overlap>
-  - {Path}             : Markdown file path (required)
-  - <collection_name>  : Collection name (default: filename)
-  - <chunk_size>       : Chunk size in chars (default: 600)
-  - <chunk_overlap>    : Overlap size in chars (default: 100)""",
-                style=ResultStyle.WARNING
-            )
-        
-        target = store_parts[2].lower()
+        target = parts[1].lower()
         if target != "markdown":
             return CommandResult(
                 cmd_type=CommandType.VECTOR,
@@ -295,28 +339,20 @@ def _parse_vector_command(command: str) -> CommandResult:
                 style=ResultStyle.ERROR
             )
         
-        file_path = store_parts[3]
-        collection_name = store_parts[4] if len(store_parts) > 4 else None
-        
-        try:
-            chunk_size = int(store_parts[5]) if len(store_parts) > 5 else 600
-        except ValueError:
-            return CommandResult(
-                cmd_type=CommandType.VECTOR,
-                success=False,
-                title="❌ Vector Command Error",
-                output=f"Invalid chunk_size: {store_parts[5]} (must be integer)",
-                style=ResultStyle.ERROR
-            )
+        file_path = parts[2]
+        collection_name = parts[3] if len(parts) > 3 else None
         
-        try:
-            chunk_overlap = int(store_parts[6]) if len(store_parts) > 6 else 100
-        except ValueError:
+        chunk_size, chunk_overlap, error = 600, 100, None
+        if len(parts) > 4:
+            chunk_size, error = _parse_int_arg(parts[4], "chunk_size", 1)
+        if error is None and len(parts) > 5:
+            chunk_overlap, error = _parse_int_arg(parts[5], "chunk_overlap", 0)
+        if error is not None:
             return CommandResult(
                 cmd_type=CommandType.VECTOR,
                 success=False,
                 title="❌ Vector Command Error",
-                output=f"Invalid chunk_overlap: {store_parts[6]} (must be integer)",
+                output=error,
                 style=ResultStyle.ERROR
             )
         
@@ -348,3 +384,12 @@ def _parse_vector_command(command: str) -> CommandResult:
         style=ResultStyle.ERROR
     )
 
+
+# 内置命令分发表：首个词（小写） -> 处理函数（参数为其后的部分）
+_COMMAND_HANDLERS = {
+    "exit": _handle_exit,
+    "quit": _handle_exit,
+    "q": _handle_exit,
+    "shell": _handle_shell,
+    "vector": _parse_vector_command,
+}
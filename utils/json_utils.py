@@ -0,0 +1,63 @@
+"""
+JSON 编解码工具
+优先使用 orjson（C 扩展），未安装时回退到标准库 json
+"""
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson 为可选依赖
+    orjson = None
+
+
+JSONDecodeError = json.JSONDecodeError
+
+
+def dumps(obj: Any) -> str:
+    """
+    序列化为 JSON 字符串（保留非 ASCII 字符）
+    Args:
+        obj: 要序列化的对象
+    Returns:
+        JSON 字符串
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj).decode("utf-8")
+        except TypeError:
+            # orjson 不支持的类型（如非 str 键）交给标准库处理
+            pass
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def dumps_pretty(obj: Any) -> str:
+    """
+    序列化为带 2 空格缩进的 JSON 字符串（用于展示/保存）
+    Args:
+        obj: 要序列化的对象
+    Returns:
+        JSON 字符串
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, indent=2)
+
+
+def loads(data: str | bytes) -> Any:
+    """
+    反序列化 JSON 字符串
+    Args:
+        data: JSON 字符串或 bytes
+    Returns:
+        解析后的对象
+    Raises:
+        JSONDecodeError: 内容不是合法 JSON
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -1,7 +1,7 @@
 import os
-import json
 from datetime import datetime
 from typing import Union, Dict, Any, List
+from utils import json_utils
 
 def save_content(file_path: str, content_type: str, content: Union[str, Dict[str, Any], List[Any]]):
     """
@@ -29,7 +29,7 @@ def save_content(file_path: str, content_type: str, content: Union[str, Dict[str
             tool_name = content.get('name', 'Unknown Tool')
             args = content.get('args', {})
             try:
-                args_str = json.dumps(args, ensure_ascii=False, indent=2)
+                args_str = json_utils.dumps_pretty(args)
             except:
                 args_str = str(args)
             
@@ -42,11 +42,11 @@ def save_content(file_path: str, content_type: str, content: Union[str, Dict[str
         content_str = str(content)
         try:
             if isinstance(content, (dict, list)):
-                 content_str = json.dumps(content, ensure_ascii=False, indent=2)
+                 content_str = json_utils.dumps_pretty(content)
             else:
                 # 尝试将字符串解析为 JSON
-                parsed = json.loads(content_str)
-                content_str = json.dumps(parsed, ensure_ascii=False, indent=2)
+                parsed = json_utils.loads(content_str)
+                content_str = json_utils.dumps_pretty(parsed)
             code_block_type = "json"
         except:
             code_block_type = "text"
@@ -63,7 +63,7 @@ def save_content(file_path: str, content_type: str, content: Union[str, Dict[str
         # 默认处理
         if isinstance(content, (dict, list)):
             try:
-                content_str = json.dumps(content, ensure_ascii=False, indent=2)
+                content_str = json_utils.dumps_pretty(content)
                 markdown_content = f"### {content_type.capitalize()} ({timestamp})\n\n```json\n{content_str}\n```"
             except:
                 markdown_content = f"### {content_type.capitalize()} ({timestamp})\n\n{content}"
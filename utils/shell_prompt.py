@@ -4,8 +4,11 @@ Shell Prompt utilities using prompt_toolkit
 """
 import os
 import sys
+import threading
+from bisect import bisect_left
+from collections import deque
 from pathlib import Path
-from typing import List, Optional, Callable, Set
+from typing import List, Optional, Callable, Set, Dict, Tuple, FrozenSet
 
 from prompt_toolkit import PromptSession
 from prompt_toolkit.history import FileHistory
@@ -20,6 +23,7 @@ from prompt_toolkit.keys import Keys
 from prompt_toolkit.key_binding import KeyBindings
 
 from utils.utils import get_workspace_path, list_prompt_templates
+from utils import json_utils
 import glob
 
 
@@ -144,69 +148,187 @@ def get_file_completions(partial_path: str, extensions: Optional[List[str]] = No
         pass
 
 
+# PATH 目录扫描缓存: path_dir -> (mtime_ns, 该目录下的命令)
+_path_dir_cache: Dict[str, Tuple[int, FrozenSet[str]]] = {}
+_path_dir_cache_loaded = False
+
+# 扫描结果持久化文件（位于 .captain/ 下），下次启动时未变化的目录无需重新扫描
+_SYSTEM_COMMANDS_CACHE_FILE = "system_commands.json"
+_SYSTEM_COMMANDS_CACHE_VERSION = 2
+
+
+def _load_path_dir_cache(pathext: FrozenSet[str]):
+    """从 .captain/ 读取上次的 PATH 目录扫描结果（文件缺失或格式不符时忽略）"""
+    try:
+        cache_file = get_captain_dir() / _SYSTEM_COMMANDS_CACHE_FILE
+        with open(cache_file, "rb") as f:
+            data = json_utils.loads(f.read())
+        if data.get("version") != _SYSTEM_COMMANDS_CACHE_VERSION or data.get("pathext") != sorted(pathext):
+            return
+        for path_dir, (mtime_ns, commands) in data["dirs"].items():
+            _path_dir_cache.setdefault(path_dir, (mtime_ns, frozenset(commands)))
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        pass
+
+
+def _save_path_dir_cache(pathext: FrozenSet[str]):
+    """把 PATH 目录扫描结果写入 .captain/（先写临时文件再替换，避免写出半个文件）"""
+    data = {
+        "version": _SYSTEM_COMMANDS_CACHE_VERSION,
+        "pathext": sorted(pathext),
+        "dirs": {
+            path_dir: [mtime_ns, sorted(commands)]
+            for path_dir, (mtime_ns, commands) in _path_dir_cache.items()
+        },
+    }
+    try:
+        cache_file = get_captain_dir() / _SYSTEM_COMMANDS_CACHE_FILE
+        tmp_file = cache_file.with_name(cache_file.name + ".tmp")
+        tmp_file.write_text(json_utils.dumps(data), encoding="utf-8")
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
+
+
+def _scan_path_dir(path_dir: str, pathext: FrozenSet[str]) -> FrozenSet[str]:
+    """扫描单个 PATH 目录中的可执行命令"""
+    commands = set()
+    for entry in os.scandir(path_dir):
+        if not entry.is_file():
+            continue
+        
+        name = entry.name
+        
+        if sys.platform == "win32":
+            # Windows: 检查是否有可执行扩展名（按最后一个 . 切分，一次集合查找）
+            stem, dot, ext = name.lower().rpartition(".")
+            if dot and dot + ext in pathext:
+                # 去掉扩展名
+                commands.add(stem)
+        else:
+            # Linux/Mac: 检查是否有执行权限
+            if os.access(entry.path, os.X_OK):
+                commands.add(name)
+    return frozenset(commands)
+
+
 def get_system_commands() -> Set[str]:
     """
     从系统 PATH 环境变量获取可执行命令列表
     支持 Windows/Linux/Mac
+    每个目录的扫描结果按目录 mtime 缓存（并持久化到 .captain/），目录内容未变化时不再逐个文件检查
     """
+    global _path_dir_cache_loaded
     commands = set()
     
     # Windows 可执行文件扩展名
     if sys.platform == "win32":
-        pathext = os.environ.get("PATHEXT", ".COM;.EXE;.BAT;.CMD").lower().split(";")
+        pathext = frozenset(
+            ext for ext in os.environ.get("PATHEXT", ".COM;.EXE;.BAT;.CMD").lower().split(";") if ext
+        )
     else:
-        pathext = [""]
+        pathext = frozenset()
     
     # 遍历 PATH 中的目录
     path_dirs = os.environ.get("PATH", "").split(os.pathsep)
     
+    if not _path_dir_cache_loaded:
+        _load_path_dir_cache(pathext)
+        _path_dir_cache_loaded = True
+    
+    changed = False
     for path_dir in path_dirs:
-        if not path_dir or not os.path.isdir(path_dir):
+        if not path_dir:
             continue
         
         try:
-            for entry in os.scandir(path_dir):
-                if not entry.is_file():
-                    continue
-                
-                name = entry.name
-                
-                if sys.platform == "win32":
-                    # Windows: 检查是否有可执行扩展名
-                    name_lower = name.lower()
-                    for ext in pathext:
-                        if name_lower.endswith(ext):
-                            # 去掉扩展名
-                            cmd_name = name[:len(name) - len(ext)] if ext else name
-                            commands.add(cmd_name.lower())
-                            break
-                else:
-                    # Linux/Mac: 检查是否有执行权限
-                    if os.access(entry.path, os.X_OK):
-                        commands.add(name)
+            mtime_ns = os.stat(path_dir).st_mtime_ns
+            cached = _path_dir_cache.get(path_dir)
+            if cached is not None and cached[0] == mtime_ns:
+                dir_commands = cached[1]
+            else:
+                dir_commands = _scan_path_dir(path_dir, pathext)
+                _path_dir_cache[path_dir] = (mtime_ns, dir_commands)
+                changed = True
         except (PermissionError, OSError):
-            # 跳过无法访问的目录
+            # 跳过不存在或无法访问的目录
             continue
+        
+        commands |= dir_commands
+    
+    if changed:
+        _save_path_dir_cache(pathext)
     
     return commands
 
 
 # 缓存系统命令，避免每次补全都扫描
 _system_commands_cache: Optional[Set[str]] = None
+# 前缀索引: (按小写排序的命令名小写形式, 对应的原始命令名)
+_system_commands_index: Optional[Tuple[List[str], List[str]]] = None
+
+
+_system_commands_lock = threading.Lock()
+
+
+def _set_system_commands(commands: Set[str]):
+    """更新系统命令缓存及其前缀索引"""
+    global _system_commands_cache, _system_commands_index
+    pairs = sorted((cmd.lower(), cmd) for cmd in commands)
+    # 先更新索引再发布缓存：其他线程看到缓存非空时索引一定可用
+    _system_commands_index = ([lower for lower, _ in pairs], [cmd for _, cmd in pairs])
+    _system_commands_cache = commands
 
 
 def get_cached_system_commands() -> Set[str]:
-    """获取缓存的系统命令列表"""
-    global _system_commands_cache
+    """获取缓存的系统命令列表（后台预热与补全同时调用时只扫描一次）"""
     if _system_commands_cache is None:
-        _system_commands_cache = get_system_commands()
+        with _system_commands_lock:
+            if _system_commands_cache is None:
+                _set_system_commands(get_system_commands())
     return _system_commands_cache
 
 
 def refresh_system_commands():
     """刷新系统命令缓存"""
-    global _system_commands_cache
-    _system_commands_cache = get_system_commands()
+    with _system_commands_lock:
+        _set_system_commands(get_system_commands())
+
+
+def warm_completion_caches():
+    """
+    在后台线程预热补全用到的缓存（系统命令、prompt 模板）
+    用户开始输入前扫描 PATH，首次补全不必等待
+    """
+    def _warm():
+        get_cached_system_commands()
+        try:
+            list_prompt_templates()
+        except Exception:
+            # 配置读取失败时留给首次补全时处理
+            pass
+    
+    threading.Thread(target=_warm, name="completion-warmup", daemon=True).start()
+
+
+def match_system_commands(prefix: str, limit: int = 50) -> List[str]:
+    """
+    按前缀（不区分大小写）查找系统命令
+    在排序索引上二分定位匹配区间，不再逐个遍历全部命令
+    Args:
+        prefix: 命令前缀
+        limit: 最多返回的数量
+    Returns:
+        按字母排序的匹配命令列表
+    """
+    get_cached_system_commands()
+    lowers, commands = _system_commands_index
+    prefix_lower = prefix.lower()
+    start = bisect_left(lowers, prefix_lower)
+    end = start
+    while end < len(lowers) and lowers[end].startswith(prefix_lower):
+        end += 1
+    return sorted(commands[start:end])[:limit]
 
 
 def get_captain_dir() -> Path:
@@ -224,6 +346,10 @@ def get_history_file() -> Path:
     return get_captain_dir() / "history.txt"
 
 
+# 自动补全系统命令所需的最短前缀长度（按 Tab 主动补全时不受限制）
+_MIN_SHELL_COMPLETION_PREFIX = 2
+
+
 class CaptainCompleter(Completer):
     """
     Captain 命令补全器
@@ -235,7 +361,22 @@ class CaptainCompleter(Completer):
     
     def __init__(self, get_templates_func: Optional[Callable] = None):
         self.get_templates_func = get_templates_func or list_prompt_templates
-        self._builtin_commands = ["exit", "quit", "q", "shell ", "vector ", "/list"]
+        self._builtin_commands = ("exit", "quit", "q", "shell ", "vector ", "/list")
+    
+    def _template_completions(self, text: str):
+        """补全 prompt 模板命令（text 为空或以 / 开头）"""
+        prefix = text[1:]  # 去掉 /
+        for name, info in self.get_templates_func().items():
+            if name.startswith(prefix):
+                args = info.get("args", [])
+                args_hint = " ".join(f'{a}=""' for a in args)
+                display = f"/{name} {args_hint}".strip()
+                yield Completion(
+                    display,
+                    start_position=-len(text),
+                    display=f"/{name}",
+                    display_meta=f"args: {', '.join(args) or 'none'}"
+                )
     
     def get_completions(self, document, complete_event):
         text = document.text_before_cursor
@@ -256,8 +397,9 @@ class CaptainCompleter(Completer):
         # 空输入或只有开头字符，显示所有可用命令
         if not text or text == word:
             # 内置命令
+            text_lower = text.lower()
             for cmd in self._builtin_commands:
-                if cmd.startswith(text.lower()):
+                if cmd.startswith(text_lower):
                     yield Completion(
                         cmd,
                         start_position=-len(text),
@@ -265,38 +407,15 @@ class CaptainCompleter(Completer):
                     )
             
             # prompt 模板命令
-            if text.startswith("/") or not text:
-                templates = self.get_templates_func()
-                for name, info in templates.items():
-                    cmd = f"/{name}"
-                    if cmd.startswith(text) or not text:
-                        args_hint = " ".join(f'{a}=""' for a in info.get("args", []))
-                        display = f"/{name} {args_hint}".strip()
-                        yield Completion(
-                            display,
-                            start_position=-len(text),
-                            display=f"/{name}",
-                            display_meta=f"args: {', '.join(info.get('args', [])) or 'none'}"
-                        )
+            if not text or text.startswith("/"):
+                yield from self._template_completions(text)
         
         # / 开头，补全 prompt 模板
         elif text.startswith("/"):
-            templates = self.get_templates_func()
-            prefix = text[1:]  # 去掉 /
-            
-            for name, info in templates.items():
-                if name.startswith(prefix):
-                    args_hint = " ".join(f'{a}=""' for a in info.get("args", []))
-                    display = f"/{name} {args_hint}".strip()
-                    yield Completion(
-                        display,
-                        start_position=-len(text),
-                        display=f"/{name}",
-                        display_meta=f"args: {', '.join(info.get('args', [])) or 'none'}"
-                    )
+            yield from self._template_completions(text)
             
             # /list 命令
-            if "list".startswith(prefix):
+            if "list".startswith(text[1:]):
                 yield Completion(
                     "/list",
                     start_position=-len(text),
@@ -306,19 +425,13 @@ class CaptainCompleter(Completer):
         # shell 命令补全 - 使用系统 PATH 中的命令
         elif text.startswith("shell "):
             shell_part = text[6:]  # 去掉 "shell "
+            # 边输入边补全时，前缀太短（匹配过多）则等用户多输入几个字符；按 Tab 时照常补全
+            if len(shell_part) < _MIN_SHELL_COMPLETION_PREFIX and not complete_event.completion_requested:
+                return
             if shell_part:
                 # 只在有输入时才补全，避免显示太多命令
-                system_cmds = get_cached_system_commands()
-                shell_part_lower = shell_part.lower()
-                
-                # 优先显示前缀匹配的命令
-                matches = []
-                for cmd in system_cmds:
-                    if cmd.lower().startswith(shell_part_lower):
-                        matches.append(cmd)
-                
-                # 限制显示数量，按字母排序
-                for cmd in sorted(matches)[:50]:
+                # 前缀匹配，限制显示数量，按字母排序
+                for cmd in match_system_commands(shell_part, limit=50):
                     yield Completion(
                         cmd,
                         start_position=-len(shell_part),
@@ -544,6 +657,9 @@ class CaptainShell:
         )
         self.prompt_message = get_prompt_message()
         self.style = create_prompt_style()
+        
+        if enable_completion:
+            warm_completion_caches()
     
     async def prompt_async(self) -> str:
         """异步获取用户输入"""
@@ -559,14 +675,20 @@ class CaptainShell:
             style=self.style
         )
     
-    def get_history(self) -> List[str]:
-        """获取历史记录列表"""
+    def get_history(self, limit: Optional[int] = None) -> List[str]:
+        """
+        获取历史记录列表
+        Args:
+            limit: 只返回最近的 limit 条（默认全部）
+        """
         history_file = get_history_file()
         if history_file.exists():
             with open(history_file, "r", encoding="utf-8") as f:
-                # FileHistory 格式: 每行一个命令，+ 开头
-                lines = f.readlines()
-                return [line[1:].strip() for line in lines if line.startswith("+")]
+                # FileHistory 格式: 每行一个命令，+ 开头；逐行读取，不整体载入
+                entries = (line[1:].strip() for line in f if line.startswith("+"))
+                if limit is None:
+                    return list(entries)
+                return list(deque(entries, maxlen=limit))
         return []
     
     def clear_history(self):
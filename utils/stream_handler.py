@@ -1,15 +1,41 @@
 """流式输出处理器 - 管理 Agent 响应的 UI 渲染"""
 
-import json
+import time
 from collections import OrderedDict
-from typing import Any, Callable
+from functools import lru_cache
+from typing import Any, Callable, TYPE_CHECKING
 from rich.console import Console, Group
-from rich.markdown import Markdown
 from rich.panel import Panel
 from rich.live import Live
 from rich.text import Text
 from rich import box
 
+from utils import json_utils
+
+if TYPE_CHECKING:
+    from rich.markdown import Markdown
+
+
+def _markdown(text: str) -> "Markdown | str":
+    """
+    构造 Markdown 渲染对象，失败时退回纯文本
+    rich.markdown 依赖 markdown-it/pygments，首次渲染回答时才导入
+    """
+    from rich.markdown import Markdown
+    try:
+        return Markdown(text)
+    except Exception:
+        return text
+
+
+@lru_cache(maxsize=128)
+def _panel_title(markup: str) -> Text:
+    """
+    解析面板标题 markup 并缓存（Panel 渲染时会复制标题 Text，可安全共享）
+    流式面板每次刷新都会重建，标题只需解析一次
+    """
+    return Text.from_markup(markup)
+
 
 class StreamHandler:
     """处理 Agent 流式响应的 UI 渲染"""
@@ -29,6 +55,17 @@ class StreamHandler:
         # Live 显示管理
         self.current_live: Live | None = None
         self.tools_live: Live | None = None
+        
+        # 流式面板渲染节流：缓冲长度、当前 Live 已渲染的长度/时间，
+        # 以及被跳过、尚待补渲染的面板 (is_answer, title, border_style)
+        self.thinking_len = 0
+        self.answer_len = 0
+        self._rendered_len = 0
+        self._rendered_ts = 0.0
+        self._stale_panel: tuple[bool, str, str] | None = None
+        
+        # 事件分发表（每个事件只做一次字典查找，不再逐事件创建闭包）
+        self._handlers = self._build_handlers()
     
     def reset(self):
         """重置所有状态"""
@@ -37,6 +74,9 @@ class StreamHandler:
         self.thinking_buffer.clear()
         self.answer_buffer.clear()
         self.current_state = None
+        self.thinking_len = 0
+        self.answer_len = 0
+        self._stale_panel = None
         self._stop_current_live()
         self._stop_tools_live()
     
@@ -57,9 +97,12 @@ class StreamHandler:
     
     def _stop_current_live(self):
         """停止主 Live"""
+        self._flush_stale_panel()
         if self.current_live is not None:
             self.current_live.stop()
             self.current_live = None
+        self._rendered_len = 0
+        self._rendered_ts = 0.0
     
     def _render_pending_tools(self) -> Group | None:
         """渲染 pending 状态的工具"""
@@ -78,7 +121,7 @@ class StreamHandler:
                         ("⏳ ", "yellow"),
                         ("Processing...", "yellow italic")
                     ),
-                    title=f"[bold cyan]🔧 Tool Call: {name_display}[/bold cyan]",
+                    title=_panel_title(f"[bold cyan]🔧 Tool Call: {name_display}[/bold cyan]"),
                     border_style="cyan",
                     box=box.ROUNDED
                 )
@@ -110,16 +153,62 @@ class StreamHandler:
             self.tools_live.stop()
             self.tools_live = None
     
+    # ==================== 流式面板渲染节流 ====================
+    
+    # 新增字符数/间隔未达到阈值时不重建面板（拼接与 Markdown 解析代价与全文长度成正比）
+    _RENDER_MIN_CHARS = 32
+    _RENDER_MIN_INTERVAL = 0.1
+    
+    def _render_stream(self, is_answer: bool, title: str, border_style: str, force: bool = False):
+        """按节流策略用完整缓冲重建思考/回答面板（回答按 Markdown 渲染）"""
+        buffered_len = self.answer_len if is_answer else self.thinking_len
+        now = time.monotonic()
+        if (
+            not force
+            and self.current_live is not None
+            and buffered_len - self._rendered_len < self._RENDER_MIN_CHARS
+            and now - self._rendered_ts < self._RENDER_MIN_INTERVAL
+        ):
+            self._stale_panel = (is_answer, title, border_style)
+            return
+        
+        self._stale_panel = None
+        self._rendered_len = buffered_len
+        self._rendered_ts = now
+        
+        if is_answer:
+            content: Any = _markdown("".join(self.answer_buffer))
+        else:
+            content = "".join(self.thinking_buffer)
+        
+        self._update_live(
+            Panel(
+                content,
+                title=_panel_title(title),
+                border_style=border_style,
+                box=box.ROUNDED
+            )
+        )
+    
+    def _flush_stale_panel(self):
+        """Live 停止或缓冲清空前，补渲染被节流跳过的尾部内容"""
+        if self._stale_panel is not None and self.current_live is not None:
+            self._render_stream(*self._stale_panel, force=True)
+        self._stale_panel = None
+    
     # ==================== 状态切换辅助 ====================
     
     def _save_and_clear_buffers(self, think_type: str = "think", answer_type: str = "answer"):
         """保存并清空缓冲区"""
+        self._flush_stale_panel()
         if self.thinking_buffer:
             self.save_content(self.output_path, think_type, "".join(self.thinking_buffer))
             self.thinking_buffer.clear()
+            self.thinking_len = 0
         if self.answer_buffer:
             self.save_content(self.output_path, answer_type, "".join(self.answer_buffer))
             self.answer_buffer.clear()
+            self.answer_len = 0
     
     def _transition_from_tool_state(self):
         """从工具状态切换时的处理"""
@@ -142,14 +231,8 @@ class StreamHandler:
         self.current_state = "model_thinking"
         
         self.thinking_buffer.append(content)
-        self._update_live(
-            Panel(
-                "".join(self.thinking_buffer),
-                title="[bold yellow]🤔 Model Thinking[/bold yellow]",
-                border_style="yellow",
-                box=box.ROUNDED
-            )
-        )
+        self.thinking_len += len(content)
+        self._render_stream(False, "[bold yellow]🤔 Model Thinking[/bold yellow]", "yellow")
     
     def handle_model_answer(self, content: str):
         """处理模型回答"""
@@ -157,78 +240,57 @@ class StreamHandler:
         self.current_state = "model_answer"
         
         self.answer_buffer.append(content)
-        answer_text = "".join(self.answer_buffer)
-        
-        try:
-            md_content = Markdown(answer_text)
-        except Exception:
-            md_content = answer_text
-        
-        self._update_live(
-            Panel(
-                md_content,
-                title="[bold green]💬 Model Answer[/bold green]",
-                border_style="green",
-                box=box.ROUNDED
-            )
-        )
+        self.answer_len += len(content)
+        self._render_stream(True, "[bold green]💬 Model Answer[/bold green]", "green")
     
-    def handle_tool_call(self, content: str):
-        """处理工具调用"""
+    def handle_tool_call(self, tool_data: dict):
+        """处理工具调用（tool_data 含 name/args/id）"""
         if self.current_state not in ("tool_call", "tool_result"):
             if self.current_live:
                 self._save_and_clear_buffers()
                 self._stop_current_live()
         self.current_state = "tool_call"
         
+        tool_id = tool_data.get('id') or ''
+        tool_name = tool_data.get('name') or ''
+        tool_args = tool_data.get('args') or {}
+        
         try:
-            tool_data = json.loads(content)
-            tool_id = tool_data.get('id', '')
-            tool_name = tool_data.get('name', '')
-            tool_args = tool_data.get('args', {})
-            
-            try:
-                args_str = json.dumps(tool_args, ensure_ascii=False, indent=2)
-            except:
-                args_str = str(tool_args)
-            
-            self.tool_states[tool_id] = {
-                "name": tool_name,
-                "args_str": args_str,
-                "status": "pending",
-                "result": None
-            }
-            
-            if tool_id in self.pending_results:
-                self.tool_states[tool_id]["status"] = "complete"
-                self.tool_states[tool_id]["result"] = str(self.pending_results[tool_id])
-                del self.pending_results[tool_id]
-                self._stop_tools_live()
-                self._print_tool_complete(self.tool_states[tool_id])
-            else:
-                self._update_tools_live()
-        except json.JSONDecodeError:
-            self.console.print(Panel(f"Error parsing tool call: {content}", style="red"))
-    
-    def handle_tool_result(self, content: str):
-        """处理工具结果"""
+            args_str = json_utils.dumps_pretty(tool_args)
+        except:
+            args_str = str(tool_args)
+        
+        self.tool_states[tool_id] = {
+            "name": tool_name,
+            "args_str": args_str,
+            "status": "pending",
+            "result": None
+        }
+        
+        if tool_id in self.pending_results:
+            self.tool_states[tool_id]["status"] = "complete"
+            self.tool_states[tool_id]["result"] = str(self.pending_results[tool_id])
+            del self.pending_results[tool_id]
+            # 完成面板打印在工具 Live 上方，Live 保持运行，不再停止后重建
+            self._print_tool_complete(self.tool_states[tool_id])
+        else:
+            self._update_tools_live()
+    
+    def handle_tool_result(self, result_data: dict):
+        """处理工具结果（result_data 含 content/id）"""
         self.current_state = "tool_result"
         
-        try:
-            result_data = json.loads(content)
-            tool_id = result_data.get('id', '')
-            tool_result = result_data.get('content', content)
-            
-            if tool_id in self.tool_states:
-                self.tool_states[tool_id]["status"] = "complete"
-                self.tool_states[tool_id]["result"] = str(tool_result)
-                self._stop_tools_live()
-                self._print_tool_complete(self.tool_states[tool_id])
-                self._update_tools_live()
-            else:
-                self.pending_results[tool_id] = tool_result
-        except json.JSONDecodeError:
-            self.console.print(Panel(f"Error parsing tool result: {content}", style="red"))
+        tool_id = result_data.get('id') or ''
+        tool_result = result_data.get('content', '')
+        
+        if tool_id in self.tool_states:
+            self.tool_states[tool_id]["status"] = "complete"
+            self.tool_states[tool_id]["result"] = str(tool_result)
+            # 先刷新 pending 列表（无 pending 时自动停止），再在其上方打印完成面板
+            self._update_tools_live()
+            self._print_tool_complete(self.tool_states[tool_id])
+        else:
+            self.pending_results[tool_id] = tool_result
     
     def _print_tool_complete(self, state: dict):
         """打印工具完成结果"""
@@ -296,13 +358,8 @@ class StreamHandler:
         self._stop_tools_live()
         
         result_preview = content[:500] + "..." if len(content) > 500 else content
-        try:
-            md_content = Markdown(result_preview)
-        except Exception:
-            md_content = result_preview
-        
         self.console.print(Panel(
-            md_content,
+            _markdown(result_preview),
             title="[bold green]✅ Sub Agent Complete[/bold green]",
             border_style="green",
             box=box.ROUNDED
@@ -315,14 +372,8 @@ class StreamHandler:
         self.current_state = "sub_agent_thinking"
         
         self.thinking_buffer.append(content)
-        self._update_live(
-            Panel(
-                "".join(self.thinking_buffer),
-                title=f"[bold yellow]🤔 {subagent} Thinking[/bold yellow]",
-                border_style="yellow",
-                box=box.ROUNDED
-            )
-        )
+        self.thinking_len += len(content)
+        self._render_stream(False, f"[bold yellow]🤔 {subagent} Thinking[/bold yellow]", "yellow")
     
     def handle_sub_agent_answer(self, content: str, subagent: str):
         """处理子代理回答"""
@@ -330,85 +381,66 @@ class StreamHandler:
         self.current_state = "sub_agent_answer"
         
         self.answer_buffer.append(content)
-        answer_text = "".join(self.answer_buffer)
-        
-        try:
-            md_content = Markdown(answer_text)
-        except Exception:
-            md_content = answer_text
-        
-        self._update_live(
-            Panel(
-                md_content,
-                title=f"[bold magenta]💬 {subagent} Answer[/bold magenta]",
-                border_style="magenta",
-                box=box.ROUNDED
-            )
-        )
+        self.answer_len += len(content)
+        self._render_stream(True, f"[bold magenta]💬 {subagent} Answer[/bold magenta]", "magenta")
     
-    def handle_sub_agent_tool_call(self, content: str):
-        """处理子代理工具调用"""
+    def handle_sub_agent_tool_call(self, tool_data: dict):
+        """处理子代理工具调用（tool_data 含 name/args/id/subagent）"""
         if self.current_state not in ("tool_call", "tool_result", "sub_agent_tool_call", "sub_agent_tool_result"):
             if self.current_live:
                 self._save_and_clear_buffers("sub_agent_think", "sub_agent_answer")
                 self._stop_current_live()
         self.current_state = "sub_agent_tool_call"
         
+        tool_id = tool_data.get('id') or ''
+        tool_name = tool_data.get('name') or ''
+        tool_args = tool_data.get('args') or {}
+        subagent_name = tool_data.get('subagent') or 'SubAgent'
+        
         try:
-            tool_data = json.loads(content)
-            tool_id = tool_data.get('id', '')
-            tool_name = tool_data.get('name', '')
-            tool_args = tool_data.get('args', {})
-            subagent_name = tool_data.get('subagent', 'SubAgent')
-            
-            try:
-                args_str = json.dumps(tool_args, ensure_ascii=False, indent=2)
-            except:
-                args_str = str(tool_args)
-            
-            self.tool_states[tool_id] = {
-                "name": tool_name,
-                "args_str": args_str,
-                "status": "pending",
-                "result": None,
-                "subagent": subagent_name
-            }
-            
-            if tool_id in self.pending_results:
-                self.tool_states[tool_id]["status"] = "complete"
-                self.tool_states[tool_id]["result"] = str(self.pending_results[tool_id])
-                del self.pending_results[tool_id]
-                self._stop_tools_live()
-                self._print_tool_complete(self.tool_states[tool_id])
-            else:
-                self._update_tools_live()
-        except json.JSONDecodeError:
-            self.console.print(Panel(f"Error parsing sub_agent tool call: {content}", style="red"))
-    
-    def handle_sub_agent_tool_result(self, content: str):
-        """处理子代理工具结果"""
+            args_str = json_utils.dumps_pretty(tool_args)
+        except:
+            args_str = str(tool_args)
+        
+        self.tool_states[tool_id] = {
+            "name": tool_name,
+            "args_str": args_str,
+            "status": "pending",
+            "result": None,
+            "subagent": subagent_name
+        }
+        
+        if tool_id in self.pending_results:
+            self.tool_states[tool_id]["status"] = "complete"
+            self.tool_states[tool_id]["result"] = str(self.pending_results[tool_id])
+            del self.pending_results[tool_id]
+            # 完成面板打印在工具 Live 上方，Live 保持运行，不再停止后重建
+            self._print_tool_complete(self.tool_states[tool_id])
+        else:
+            self._update_tools_live()
+    
+    def handle_sub_agent_tool_result(self, result_data: dict):
+        """处理子代理工具结果（result_data 含 content/id/subagent）"""
         self.current_state = "sub_agent_tool_result"
         
-        try:
-            result_data = json.loads(content)
-            tool_id = result_data.get('id', '')
-            tool_result = result_data.get('content', content)
-            
-            if tool_id in self.tool_states:
-                self.tool_states[tool_id]["status"] = "complete"
-                self.tool_states[tool_id]["result"] = str(tool_result)
-                self._stop_tools_live()
-                self._print_tool_complete(self.tool_states[tool_id])
-                self._update_tools_live()
-            else:
-                self.pending_results[tool_id] = tool_result
-        except json.JSONDecodeError:
-            self.console.print(Panel(f"Error parsing sub_agent tool result: {content}", style="red"))
-    
-    def handle_error(self, content: str):
-        """处理错误"""
+        tool_id = result_data.get('id') or ''
+        tool_result = result_data.get('content', '')
+        
+        if tool_id in self.tool_states:
+            self.tool_states[tool_id]["status"] = "complete"
+            self.tool_states[tool_id]["result"] = str(tool_result)
+            # 先刷新 pending 列表（无 pending 时自动停止），再在其上方打印完成面板
+            self._update_tools_live()
+            self._print_tool_complete(self.tool_states[tool_id])
+        else:
+            self.pending_results[tool_id] = tool_result
+    
+    def handle_error(self, content: str, tb: Any = None):
+        """处理错误（tb 为延迟格式化的异常堆栈，仅在展示时才格式化）"""
         self._stop_tools_live()
         self._stop_current_live()
+        if tb is not None:
+            content = f"{content}\nTraceback:\n{tb}"
         self.console.print(Panel(
             content,
             title="[bold red]❌ Error from ChatStream[/bold red]",
@@ -418,38 +450,36 @@ class StreamHandler:
     
     # ==================== 主处理入口 ====================
     
+    def _build_handlers(self) -> dict[str, Callable[[dict], None]]:
+        """事件类型 -> 处理函数（参数为完整响应），构造时建立一次"""
+        def content(response: dict) -> Any:
+            return response.get("content", "")
+        
+        def subagent(response: dict) -> str:
+            return str(response.get("subagent", "SubAgent"))
+        
+        return {
+            "model_thinking": lambda r: self.handle_model_thinking(content(r)),
+            "model_answer": lambda r: self.handle_model_answer(content(r)),
+            "tool_call": self.handle_tool_call,
+            "tool_result": self.handle_tool_result,
+            "sub_agent_start": self.handle_sub_agent_start,
+            "sub_agent_end": lambda r: self.handle_sub_agent_end(content(r)),
+            "sub_agent_thinking": lambda r: self.handle_sub_agent_thinking(content(r), subagent(r)),
+            "sub_agent_answer": lambda r: self.handle_sub_agent_answer(content(r), subagent(r)),
+            "sub_agent_tool_call": self.handle_sub_agent_tool_call,
+            "sub_agent_tool_result": self.handle_sub_agent_tool_result,
+            "error": lambda r: self.handle_error(content(r), r.get("traceback")),
+        }
+    
     def handle_response(self, response: dict | None):
         """处理单个响应"""
         if response is None:
             return
         
-        response_type = response.get("type")
-        if not response_type:
-            return
-            
-        content = response.get("content", "")
-        
-        handlers = {
-            "model_thinking": lambda: self.handle_model_thinking(content),
-            "model_answer": lambda: self.handle_model_answer(content),
-            "tool_call": lambda: self.handle_tool_call(content),
-            "tool_result": lambda: self.handle_tool_result(content),
-            "sub_agent_start": lambda: self.handle_sub_agent_start(response),
-            "sub_agent_end": lambda: self.handle_sub_agent_end(content),
-            "sub_agent_thinking": lambda: self.handle_sub_agent_thinking(
-                content, str(response.get("subagent", "SubAgent"))
-            ),
-            "sub_agent_answer": lambda: self.handle_sub_agent_answer(
-                content, str(response.get("subagent", "SubAgent"))
-            ),
-            "sub_agent_tool_call": lambda: self.handle_sub_agent_tool_call(content),
-            "sub_agent_tool_result": lambda: self.handle_sub_agent_tool_result(content),
-            "error": lambda: self.handle_error(content),
-        }
-        
-        handler = handlers.get(response_type)
+        handler = self._handlers.get(response.get("type"))
         if handler:
-            handler()
+            handler(response)
     
     def finalize(self):
         """流结束时的清理"""
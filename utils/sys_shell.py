@@ -1,11 +1,24 @@
+import os
+import selectors
+import signal
 import subprocess
 import sys
+import threading
+import time
 import locale
-from utils.utils import get_workspace_path
-from pathlib import Path
+from collections import deque
+from utils.utils import get_workspace_root
 from typing import Optional, Tuple
 
-def _get_shell_encoding() -> str:
+_SHELL_TIMEOUT = 30
+# stdout/stderr 各自最多保留的行数（只保留末尾，与终端滚动后看到的一致）
+_MAX_OUTPUT_LINES = 2000
+# stdout/stderr 各自最多保留的字节数（防止无换行的超长输出占满内存）
+_MAX_OUTPUT_BYTES = 1 << 20
+# 管道读缓冲大小：以字节读取、结束后一次解码，避免逐段文本解码和频繁 read()
+_PIPE_BUFFER_SIZE = 64 * 1024
+
+def _detect_shell_encoding() -> str:
     """Get the appropriate encoding for shell output."""
     if sys.platform == 'win32':
         # On Windows, use the console output code page (usually GBK for Chinese Windows)
@@ -16,31 +29,176 @@ def _get_shell_encoding() -> str:
             return locale.getpreferredencoding(False)
     return 'utf-8'
 
+# 进程运行期间不会变化，导入时检测一次
+_SHELL_ENCODING = _detect_shell_encoding()
+
+class _TailBuffer:
+    """只保留最后 max_lines 行、至多 max_bytes 字节的输出，并记录被丢弃的行数和字节数"""
+    
+    def __init__(self, max_lines: int, max_bytes: int):
+        self.lines: deque = deque()
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.size = 0           # 保留的字节数
+        self.total = 0          # 收到的总行数
+        self.omitted_bytes = 0  # 丢弃的字节数
+        self.cut = False        # 是否截断过单个超长行
+    
+    def feed(self, data: bytes):
+        """追加一段输出（可能从行中间截断，与上一段未结束的行拼接）"""
+        if self.lines and not self.lines[-1].endswith(b"\n"):
+            last = self.lines.pop()
+            self.size -= len(last)
+            self.total -= 1
+            data = last + data
+        for line in data.splitlines(keepends=True):
+            self.lines.append(line)
+            self.size += len(line)
+            self.total += 1
+        # 超出行数或字节数上限时丢弃最早的行
+        while len(self.lines) > self.max_lines or (self.size > self.max_bytes and len(self.lines) > 1):
+            dropped = len(self.lines.popleft())
+            self.size -= dropped
+            self.omitted_bytes += dropped
+        if self.size > self.max_bytes:
+            # 剩下的单行仍超过上限：只保留该行末尾
+            cut = self.size - self.max_bytes
+            self.lines[0] = self.lines[0][cut:]
+            self.size -= cut
+            self.omitted_bytes += cut
+            self.cut = True
+    
+    def drain(self, stream):
+        """读到 EOF 为止（在后台线程中运行）"""
+        for chunk in iter(lambda: stream.read1(_PIPE_BUFFER_SIZE), b""):
+            self.feed(chunk)
+    
+    def data(self) -> bytes:
+        data = b"".join(self.lines)
+        dropped = self.total - len(self.lines)
+        if self.cut:
+            data = f"...({self.omitted_bytes} earlier bytes omitted)\n".encode("ascii") + data
+        elif dropped:
+            data = f"...({dropped} earlier lines omitted)\n".encode("ascii") + data
+        return data
+
+
+def _decode(data: bytes) -> str:
+    """与 text=True 一致：替换无法解码的字节并统一换行符"""
+    text = data.decode(_SHELL_ENCODING, errors='replace')
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+def _kill(process: subprocess.Popen):
+    """结束 shell 及（POSIX 下）它启动的所有子进程"""
+    try:
+        if sys.platform == 'win32':
+            process.kill()
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _collect_with_selector(process: subprocess.Popen, stdout_tail: _TailBuffer, stderr_tail: _TailBuffer, deadline: float):
+    """POSIX: 单线程用 selectors 同时读取 stdout/stderr，到期未读完则抛出 TimeoutExpired"""
+    with selectors.DefaultSelector() as selector:
+        selector.register(process.stdout, selectors.EVENT_READ, stdout_tail)
+        selector.register(process.stderr, selectors.EVENT_READ, stderr_tail)
+        # 后台子进程可能仍占用管道，读取同样受超时限制
+        while selector.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(process.args, _SHELL_TIMEOUT)
+            for key, _ in selector.select(remaining):
+                data = os.read(key.fd, _PIPE_BUFFER_SIZE)
+                if data:
+                    key.data.feed(data)
+                else:
+                    selector.unregister(key.fileobj)
+
+
+def _collect_with_threads(process: subprocess.Popen, stdout_tail: _TailBuffer, stderr_tail: _TailBuffer, deadline: float):
+    """Windows: 管道不支持 select，用两个后台线程读取，到期未读完则抛出 TimeoutExpired"""
+    readers = [
+        threading.Thread(target=stdout_tail.drain, args=(process.stdout,), daemon=True),
+        threading.Thread(target=stderr_tail.drain, args=(process.stderr,), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join(max(0.0, deadline - time.monotonic()))
+    if any(reader.is_alive() for reader in readers):
+        raise subprocess.TimeoutExpired(process.args, _SHELL_TIMEOUT)
+
+
+def _spawn(command: str) -> subprocess.Popen:
+    """经 shell 启动命令"""
+    return subprocess.Popen(
+        command,
+        shell=True,
+        cwd=get_workspace_root(),   # 使用绝对路径（解析结果已缓存）
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        bufsize=_PIPE_BUFFER_SIZE,
+        # 独立进程组，超时时可以连同子进程一起结束
+        start_new_session=sys.platform != 'win32',
+    )
+
+
+def _sys_shell_bytes(command: str) -> Tuple[int, bytes, bytes]:
+    """
+    执行 shell 命令，返回未解码的原始输出（stdout/stderr 各自只保留末尾 _MAX_OUTPUT_LINES 行、_MAX_OUTPUT_BYTES 字节）
+    Args:
+        command: shell 命令
+    Returns:
+        (returncode, stdout, stderr)
+    Raises:
+        subprocess.TimeoutExpired: 超过 _SHELL_TIMEOUT 秒（命令及其子进程已被结束）
+    """
+    process = _spawn(command)
+    
+    # 边读边丢弃旧行，输出再多内存占用也有上限
+    stdout_tail = _TailBuffer(_MAX_OUTPUT_LINES, _MAX_OUTPUT_BYTES)
+    stderr_tail = _TailBuffer(_MAX_OUTPUT_LINES, _MAX_OUTPUT_BYTES)
+    
+    deadline = time.monotonic() + _SHELL_TIMEOUT
+    try:
+        if sys.platform == 'win32':
+            _collect_with_threads(process, stdout_tail, stderr_tail, deadline)
+        else:
+            _collect_with_selector(process, stdout_tail, stderr_tail, deadline)
+        returncode = process.wait(timeout=max(0.0, deadline - time.monotonic()))
+    except subprocess.TimeoutExpired:
+        _kill(process)
+        process.wait()
+        raise
+    
+    return returncode, stdout_tail.data(), stderr_tail.data()
+
+
 def sys_shell(
     command: str
-) -> str:
+) -> Tuple[bool, str]:
+    """
+    执行 shell 命令
+    Args:
+        command: shell 命令
+    Returns:
+        (ok, output): 是否成功（退出码为 0），以及输出或 "Error: ..." 错误信息
+    """
     try:
-        encoding = _get_shell_encoding()
-        result = subprocess.run(
-            command,
-            shell=True,
-            cwd=Path(get_workspace_path()).resolve(),   # 使用绝对路径
-            capture_output=True,
-            text=True,
-            encoding=encoding,
-            errors='replace',  # Handle encoding errors gracefully
-            timeout=30
-        )
-        if result.returncode == 0:
-            return result.stdout if result.stdout else "(no output)"
-        else:
-            return f"Error: {result.stderr}" if result.stderr else f"Error: Command failed with code {result.returncode}"
+        returncode, stdout, stderr = _sys_shell_bytes(command)
     except subprocess.TimeoutExpired:
-        return "Error: Command timed out"
-    except subprocess.CalledProcessError as e:
-        return f"Error: {e.stderr}"
+        return False, "Error: Command timed out"
     except Exception as e:
-        return f"Error: {str(e)}"
+        return False, f"Error: {str(e)}"
+    
+    # 只解码实际返回的那一路输出
+    if returncode == 0:
+        return True, _decode(stdout) if stdout else "(no output)"
+    else:
+        return False, f"Error: {_decode(stderr)}" if stderr else f"Error: Command failed with code {returncode}"
 
 def parse_shell_command(query: str) -> Tuple[bool, Optional[str]]:
     """
@@ -67,10 +225,9 @@ def execute_shell_command(command: str) -> dict:
             "output": str
         }
     """
-    result = sys_shell(command)
-    is_error = result.startswith("Error:")
+    ok, output = sys_shell(command)
     return {
-        "success": not is_error,
+        "success": ok,
         "command": command,
-        "output": result
+        "output": output
     }
\ No newline at end of file
@@ -1,13 +1,34 @@
 import tomllib
 import os
 import re
+import sys
 from pathlib import Path
 from typing import Optional, Tuple
 
+try:
+    import rtoml
+except ImportError:  # rtoml 为可选依赖（Rust 实现，解析比纯 Python 的 tomllib 快得多）
+    rtoml = None
+
+# 两者都返回普通 dict，接口一致
+_toml_loads = rtoml.loads if rtoml is not None else tomllib.loads
+
 _toml_path = ""
 _captain_db_path = ""
 _local_file_store_path = ""
 _workspace_path = ""
+_workspace_root: Optional[Path] = None
+
+# TOML 解析缓存: (toml_path, mtime_ns, size, config)
+_toml_cache: Optional[Tuple[str, int, int, dict]] = None
+
+# prompt 模板注册表缓存: (源 prompt_templates 字典, {名称: _PromptEntry}, 摘要)
+_template_registry_cache: Optional[Tuple[dict, dict, dict]] = None
+
+# prompt 命令参数: key="value" 或 key='value'
+_PROMPT_ARG_RE = re.compile(r'(\w+)\s*=\s*["\']([^"\']*)["\']')
+# prompt 模板中的占位符: {key}
+_PLACEHOLDER_RE = re.compile(r'\{(\w+)\}')
 
 _major_config = {
     "configurable": {
@@ -29,8 +50,51 @@ def set_toml_path(path: str):
     Args:
         path: toml路径
     """
-    global _toml_path
+    global _toml_path, _toml_cache
     _toml_path = path
+    # 切换配置文件时丢弃旧文件的解析结果
+    _toml_cache = None
+
+def get_toml_path():
+    """
+    获取toml路径
+    Returns:
+        toml_path: toml路径
+    """
+    return _toml_path
+
+def _load_toml() -> dict:
+    """
+    读取并解析 TOML 配置，按文件 mtime/size 缓存
+    配置文件未修改时直接返回缓存，不再读盘和解析
+    Returns:
+        config: 完整配置字典（只读，调用方不应修改）
+    """
+    global _toml_cache
+    stat = os.stat(_toml_path)
+    if (
+        _toml_cache is not None
+        and _toml_cache[0] == _toml_path
+        and _toml_cache[1] == stat.st_mtime_ns
+        and _toml_cache[2] == stat.st_size
+    ):
+        return _toml_cache[3]
+
+    # 先一次性读入再解析，解析期间不占用文件句柄（Windows 下编辑器可以原子替换配置文件）
+    config = _toml_loads(Path(_toml_path).read_bytes().decode("utf-8"))
+    _toml_cache = (_toml_path, stat.st_mtime_ns, stat.st_size, config)
+    return config
+
+def get_config_stamp() -> Optional[Tuple[str, int, int]]:
+    """
+    获取当前配置文件的版本标识（来自 TOML 解析缓存），配置文件未修改时保持不变
+    Returns:
+        (toml_path, mtime_ns, size)，未设置 toml_path 时返回 None
+    """
+    if not _toml_path:
+        return None
+    _load_toml()
+    return _toml_cache[:3]
 
 def get_mcp_servers():
     """
@@ -40,9 +104,7 @@ def get_mcp_servers():
     """
     if not _toml_path:
         return "Error: toml_path is None"
-    with open(_toml_path, "rb") as f:
-        config = tomllib.load(f)
-    return config["mcp_servers"]["content"]
+    return _load_toml()["mcp_servers"]["content"]
 
 def get_model_config():
     """
@@ -52,9 +114,7 @@ def get_model_config():
     """
     if not _toml_path:
         return "Error: toml_path is None"
-    with open(_toml_path, "rb") as f:
-        config = tomllib.load(f)
-    return config
+    return _load_toml()
 
 def get_major_agent_config():
     """
@@ -116,23 +176,57 @@ def parse_prompt_command(command: str) -> Tuple[Optional[str], dict]:
     Returns:
         (template_name, args_dict): 模板名称和参数字典
     """
-    if not command or not command.strip():
+    command = command.strip() if command else ""
+    if not command:
         return None, {}
     
-    parts = command.strip().split(maxsplit=1)
-    template_name = parts[0]
+    template_name, _, args_str = command.partition(" ")
     args_dict = {}
     
-    if len(parts) > 1:
-        args_str = parts[1]
+    if args_str:
         # 匹配 key="value" 或 key='value' 格式
-        pattern = r'(\w+)\s*=\s*["\']([^"\']*)["\']'
-        matches = re.findall(pattern, args_str)
-        for key, value in matches:
-            args_dict[key] = value
+        args_dict.update(_PROMPT_ARG_RE.findall(args_str))
     
     return template_name, args_dict
 
+class _PromptEntry:
+    """预处理后的 prompt 模板"""
+    __slots__ = ("prompt", "args", "stripped", "has_placeholders")
+
+    def __init__(self, prompt: str, args: tuple):
+        self.prompt = prompt
+        self.args = args
+        # 无需替换时直接返回的结果
+        self.stripped = prompt.strip()
+        self.has_placeholders = "{" in prompt
+
+def _get_template_registry() -> Tuple[dict, dict]:
+    """
+    获取 prompt 模板注册表，配置未修改时（TOML 缓存返回同一个字典）直接复用
+    Returns:
+        (entries, summary): {名称: _PromptEntry} 与 list_prompt_templates 的摘要
+    """
+    global _template_registry_cache
+    templates = get_prompt_templates()
+    if _template_registry_cache is not None and _template_registry_cache[0] is templates:
+        return _template_registry_cache[1], _template_registry_cache[2]
+    
+    entries = {}
+    summary = {}
+    for name, config in templates.items():
+        args = config.get("args", [])
+        prompt = config.get("prompt", "")
+        entries[name] = _PromptEntry(prompt, tuple(args))
+        # 截取前 50 个字符作为预览
+        stripped = entries[name].stripped
+        preview = stripped[:50] + "..." if len(stripped) > 50 else stripped
+        summary[name] = {
+            "args": args,
+            "prompt_preview": preview
+        }
+    _template_registry_cache = (templates, entries, summary)
+    return entries, summary
+
 def get_prompt(command: str) -> Optional[str]:
     """
     根据命令获取并处理 prompt
@@ -149,44 +243,34 @@ def get_prompt(command: str) -> Optional[str]:
     if template_name is None:
         return None
     
-    templates = get_prompt_templates()
-    template = templates.get(template_name)
+    entries, _ = _get_template_registry()
+    entry = entries.get(template_name)
     
-    if template is None:
+    if entry is None:
         return None
     
-    prompt = template.get("prompt", "")
-    required_args = template.get("args", [])
-    
     # 检查是否提供了所有必需参数
-    missing_args = [arg for arg in required_args if arg not in args_dict]
+    missing_args = [arg for arg in entry.args if arg not in args_dict]
     if missing_args:
         return f"Error: Missing required arguments: {', '.join(missing_args)}"
     
-    # 替换 prompt 中的占位符
-    for key, value in args_dict.items():
-        prompt = prompt.replace(f"{{{key}}}", value)
+    # 没有参数或模板中没有占位符时无需替换
+    if not args_dict or not entry.has_placeholders:
+        return entry.stripped
     
+    # 一次扫描替换 prompt 中的占位符，未提供的参数保留原样
+    prompt = _PLACEHOLDER_RE.sub(lambda m: args_dict.get(m.group(1), m.group(0)), entry.prompt)
     return prompt.strip()
 
 def list_prompt_templates() -> dict:
     """
     列出所有可用的 prompt templates 及其参数
+    补全器每次按键都会调用，摘要在模板注册表构建时一并生成
     Returns:
-        {template_name: {"args": [...], "prompt_preview": "..."}} 字典
+        {template_name: {"args": [...], "prompt_preview": "..."}} 字典（只读，调用方不应修改）
     """
-    templates = get_prompt_templates()
-    result = {}
-    for name, config in templates.items():
-        args = config.get("args", [])
-        prompt = config.get("prompt", "")
-        # 截取前 50 个字符作为预览
-        preview = prompt.strip()[:50] + "..." if len(prompt.strip()) > 50 else prompt.strip()
-        result[name] = {
-            "args": args,
-            "prompt_preview": preview
-        }
-    return result
+    _, summary = _get_template_registry()
+    return summary
 
 def set_database_path(path: str):
     """
@@ -194,25 +278,25 @@ def set_database_path(path: str):
     Args:
         path: 工作空间路径
     """
-    global _workspace_path
+    global _workspace_path, _workspace_root
     _workspace_path = path
     
     base_path = Path(_workspace_path).resolve()
-    db_path = os.path.join(base_path, ".captain", "checkpoint.db")
-    if not os.path.exists(db_path):
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        with open(db_path, "w") as f:
-            f.write("")
+    # 顺便缓存解析结果，get_workspace_root 无需再次 resolve
+    _workspace_root = base_path
+    captain_dir = base_path / ".captain"
+    captain_dir.mkdir(parents=True, exist_ok=True)
+    
+    # touch 只在文件不存在时创建（O_CREAT 不带 O_TRUNC），不会清空已有数据库
+    db_path = captain_dir / "checkpoint.db"
+    db_path.touch(exist_ok=True)
     global _captain_db_path
-    _captain_db_path = db_path
+    _captain_db_path = str(db_path)
 
-    store_path = os.path.join(base_path, ".captain", "store.db")
-    if not os.path.exists(store_path):
-        os.makedirs(os.path.dirname(store_path), exist_ok=True)
-        with open(store_path, "w") as f:
-            f.write("")
+    store_path = captain_dir / "store.db"
+    store_path.touch(exist_ok=True)
     global _local_file_store_path
-    _local_file_store_path = store_path
+    _local_file_store_path = str(store_path)
 
 def get_database_path():
     """
@@ -238,6 +322,17 @@ def get_workspace_path():
     """
     return _workspace_path
 
+def get_workspace_root() -> Path:
+    """
+    获取解析后的工作空间绝对路径（首次调用时解析并缓存）
+    Returns:
+        workspace_root: 工作空间绝对路径
+    """
+    global _workspace_root
+    if _workspace_root is None:
+        _workspace_root = Path(_workspace_path).resolve()
+    return _workspace_root
+
 def get_embeddings_config():
     """
     获取嵌入模型配置
@@ -261,6 +356,9 @@ def get_vector_db_path():
     vector_db_path = os.path.join(base_path, ".captain", "vector_db")
     return vector_db_path
 
+# 仅在输出到终端时着色（重定向到文件/管道时不写入转义序列），并遵循 NO_COLOR 约定
+_USE_COLOR = sys.stdout.isatty() and os.environ.get("NO_COLOR") is None
+
 class Colors:
     """ANSI颜色代码"""
     HEADER = '\033[95m'
@@ -273,6 +371,9 @@ class Colors:
     BOLD = '\033[1m'
     UNDERLINE = '\033[4m'
 
+# cprint 的着色后缀：重置颜色并换行
+_COLOR_SUFFIX = Colors.ENDC + "\n"
+
 def cprint(text: str, color: str = Colors.ENDC):
     """
     带颜色的打印函数
@@ -280,4 +381,11 @@ def cprint(text: str, color: str = Colors.ENDC):
         text: 要打印的文本
         color: 颜色代码 (从Colors类获取)
     """
-    print(f"{color}{text}{Colors.ENDC}")
\ No newline at end of file
+    if not _USE_COLOR:
+        print(text)
+        return
+    # 颜色前缀与 "重置+换行" 后缀都是常量，分段写出，不再每次拼接整段文本
+    write = sys.stdout.write
+    write(color)
+    write(text)
+    write(_COLOR_SUFFIX)
\ No newline at end of file